@@ -1,12 +1,14 @@
 # make_something.py
 
 import numpy as np
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from dlake.dataset import open_dataset
 
 folderName = './Results/'
 data_path = '../Data/Preprocessed/'
-data_file = 'Data_historical.npz'
 
-data = np.load(data_path + data_file)
+data = open_dataset(data_path, days=1) # Data_historical.npz, read as needed
 ########################################################################
 # Locations: LOCS = ['BB','BO','HA','HT','LB','LBP','LBS']
 # TIME: decimal years (daily increments, at midday)
@@ -47,7 +49,7 @@ dataList = []
 for dc in inputs['abundances']:
 	for loc in inputs['locations']:
 		for div in inputs['divisions']:
-			dataFull = np.append(dataFull, data[dc][], 0)
+			dataFull = np.append(dataFull, data.series(dc, site=loc, division=div), 0)
 
 for 
 
@@ -0,0 +1,95 @@
+## Benchmark of the historical preprocessing on synthetic lake workbooks
+#! The Prediction Lab 2019
+#
+# Generates workbooks of growing size and builds them as make_historical does,
+# reporting the time and memory of each stage (load, index, regrid per
+# resolution, save) for each data source, eg.
+#   python bench_historical.py --scale 1 2 4 --sites 7 --divisions 13
+#   python bench_historical.py --scale 1 10 --weather-hours 0.25 --json bench.json
+import os, sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import tempfile
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from dlake.synthetic import make_workbooks, site_names
+from dlake.historical import SOURCES, KEYS, build_source, output_name
+from dlake.timeconv import time_grid, TIME_START
+from dlake.report import RunReport, activate, stage
+
+## Stages timed inside another one (the parse of a workbook, within its load)
+NESTED = ("open", "extract")
+
+
+def bench(folder, outdir, resolutions, sites, years):
+    """Build the products the way make_historical does (build_source per
+    source, no cache) on TIME grids spanning `years`, returns the stage
+    records of dlake.report
+    """
+    end = TIME_START + datetime.timedelta(days=365.25 * years)
+    grids = [time_grid(TIME_START, end, days=d) for d in resolutions]
+    products = [dict(LOCS=sites, TIME=g) for g in grids]
+    stages = []
+    for source in SOURCES:
+        _, outs, source_stages = build_source(source, folder, None, grids, sites)
+        stages += source_stages
+        for out, res in zip(products, outs):
+            out.update(res)
+    with activate(RunReport()) as report:
+        report.source = "ALL"
+        for days, out in zip(resolutions, products):
+            path = os.path.join(outdir, output_name(days))
+            with stage("save", rows=len(out["TIME"]), file=output_name(days)) as rec:
+                np.savez(path, **{k: out[k] for k in KEYS})
+                rec["bytes"] = os.path.getsize(path)
+    return stages + report.stages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the historical build on synthetic workbooks")
+    parser.add_argument("--scale", type=float, nargs="+", default=[1, 2, 4],
+                        help="row count multipliers (1 ~ the real Historical workbooks)")
+    parser.add_argument("--sites", type=int, default=7)
+    parser.add_argument("--divisions", type=int, default=13)
+    parser.add_argument("--years", type=float, default=6)
+    parser.add_argument("--weather-hours", type=float, default=3,
+                        help="time between weather readings")
+    parser.add_argument("--days", type=float, nargs="+", default=[1, 7],
+                        help="temporal resolutions to build")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the generated workbooks")
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scale:
+        folder = tempfile.mkdtemp(prefix="bench_lake_")
+        config = dict(scale=scale, sites=args.sites, divisions=args.divisions,
+                      years=args.years, weather_hours=args.weather_hours)
+        try:
+            t = time.perf_counter()
+            make_workbooks(folder, args.sites, args.divisions, args.years,
+                           int(750 * scale), int(36000 * scale), args.weather_hours)
+            gen = time.perf_counter() - t
+            stages = bench(folder, folder, args.days, site_names(args.sites), args.years)
+        finally:
+            if not args.keep:
+                shutil.rmtree(folder)
+        results.append(dict(config=config, generate=gen, stages=stages))
+
+        print("\n## scale %g  (%d sites, %d divisions, %g years, weather every %gh)"
+              % (scale, args.sites, args.divisions, args.years, args.weather_hours))
+        print("%-10s %-12s %9s %9s %9s %9s %9s" % ("source", "stage", "rows", "grid",
+                                                   "wall s", "cpu s", "RSS MB"))
+        for s in stages:
+            print("%-10s %-12s %9d %9s %9.3f %9.3f %9.1f" % (
+                s["source"], ("  " if s["stage"] in NESTED else "") + s["stage"],
+                s.get("rows", 0), s.get("grid", "-"), s["wall"], s["cpu"], s["peak_rss_mb"]))
+        print("%-33s %9.3f" % ("total", sum(s["wall"] for s in stages
+                                              if s["stage"] not in NESTED)))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
@@ -0,0 +1,33 @@
+## Code to reduce the USGS stream gauge exports onto the TIME grid
+#! The Prediction Lab 2019
+#
+# Streams each gauge of Historical/ApplicableUSGSStreamGauges.xlsx that has an
+# export in ./Gauges (<site number>.rdb or .rdb.gz, 15 minute data from
+# https://waterdata.usgs.gov/nwis/uv) and writes the mean, max and sum per
+# TIME step of discharge, water temperature and gage height, eg.
+#   python make_gauges.py         -> Data_gauges.npz, Data_gauges_7day.npz
+#   python make_gauges.py 1 7 30
+import os, sys
+import argparse
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from dlake.gauges import load_gauges, reduce_gauges, gauge_output_name
+from dlake.report import RunReport, activate
+from dlake.timeconv import time_grid, TIME_START, TIME_END
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the Data_gauges products")
+    parser.add_argument("days", type=float, nargs="*", default=[1, 7],
+                        help="temporal resolutions in days")
+    parser.add_argument("--gauges", default="./Gauges", help="folder of the gauge exports")
+    args = parser.parse_args()
+
+    sites, names = load_gauges("./Historical", cache_dir="./.cache")
+    grids = [time_grid(TIME_START, TIME_END, days=days) for days in args.days]
+    with activate(RunReport()) as report:
+        outs = reduce_gauges(sites, args.gauges, grids)
+    for days, out in zip(args.days, outs):
+        np.savez(os.path.join("../Preprocessed", gauge_output_name(days)), NAMES=names, **out)
+    report.save("../Preprocessed/Data_gauges_report.json", resolutions=args.days, gauges=sites)
+    for rec in report.stages:
+        print("%s: %d readings in %.1fs" % (rec["file"], rec["rows"], rec["wall"]))
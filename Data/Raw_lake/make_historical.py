@@ -0,0 +1,41 @@
+## Code to preprocess Detroit Lake empirical data Spring 2019
+#! James Watson, The Prediction Lab 2019
+#
+# Parses the raw workbooks once and writes one Data_historical*.npz per
+# temporal resolution (in days), eg.
+#   python make_historical.py             -> 1 and 7 day products
+#   python make_historical.py 1 7 14 30
+#   python make_historical.py 1 7 -j 1    -> sources one after another
+#   python make_historical.py --format npz npy  -> also memory-mapped store folders
+#   python make_historical.py --format chunks   -> yearly compressed chunks only
+#   python make_historical.py --format sparse   -> DEN, TBV, FBV stored sparse
+#   python make_historical.py --compact         -> float32 / scaled integers
+#   python make_historical.py --sites ./Historical/SiteLocations.xlsx --location Detroit_Reservoir
+#                                               -> one column per site of the workbook
+import os, sys
+import argparse
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from dlake.historical import make_historical, SOURCES, LOCS
+from dlake.sites import load_sites
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the Data_historical products")
+    parser.add_argument("days", type=float, nargs="*", default=[1, 7],
+                        help="temporal resolutions in days")
+    parser.add_argument("-j", "--jobs", type=int, default=len(SOURCES),
+                        help="worker processes for the independent data sources")
+    parser.add_argument("--format", nargs="+", choices=["npz", "npy", "chunks", "sparse"],
+                        default=["npz"], help="npz archive, memory-mapped folder of .npy "
+                        "arrays, folder of yearly compressed chunks and/or npz with "
+                        "sparse algae cubes")
+    parser.add_argument("--compact", action="store_true",
+                        help="store variables as float32 or scaled integers, checked "
+                        "against their declared precision (dlake.compact.PRECISION)")
+    parser.add_argument("--sites", help="site list: a site workbook (Site Code column) or "
+                        "a text file with one code per line (default: %s)" % " ".join(LOCS))
+    parser.add_argument("--location", help="only the workbook's sites of this General Location")
+    args = parser.parse_args()
+    sites = load_sites(args.sites, args.location, "./.cache") if args.sites else LOCS
+    make_historical(args.days, folder="./Historical", outdir="../Preprocessed",
+                    cache_dir="./.cache", processes=args.jobs, formats=args.format,
+                    compact=args.compact, sites=sites)
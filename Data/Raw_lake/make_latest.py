@@ -1,19 +1,13 @@
 ## Code to preprocess Detroit Lake empirical data Spring 2019
 #! James Watson, The Prediction Lab 2019
-import pandas as pd
-import numpy as np
-import datetime
-import openpyxl as px
-
-#### Load excel spreadsheet from Salem
-data = px.load_workbook("./PredictionLab_TXN_NUT_YSI_DRAFT.xlsx",data_only=True)
-ws = data['PREDICT']
-
-# Extract values
-column = ws['E']
-for x in np.arange(0,len(column)):
-    print(column[x].value)
-
-
-
-
+#
+# Incremental update: adds the samples of the Latest sheet (PREDICT) that are
+# newer than the last ingested ones to the existing Data_historical*.npz.
+# Run make_historical.py first, which records what it ingested.
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from dlake.latest import append_latest
+
+n = append_latest("./Latest/PredictionLab_TXN_NUT_YSI_DRAFT.xlsx", outdir="../Preprocessed",
+                  cache_dir="./.cache")
+print("%d new samples ingested" % n)
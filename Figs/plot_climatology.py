@@ -2,38 +2,25 @@ import numpy as np
 import matplotlib.pylab as plt
 from matplotlib.pyplot import figure, show, rc
 import matplotlib.cm as cm
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from dlake.dataset import open_dataset
+from dlake.timeindex import take
 
 
 
 ######## Climatology for long-term forecast
 ## Data
-data = np.load("../Data/Preprocessed/Data_historical_7day.npz")
+data = open_dataset(days=7)
 time = data['TIME']
-tox  = data['TOX4'][:,4]
-fbv  = data['FBV'][:,4,4]
-
-TI = time - np.floor(time)
-ID = np.where(np.isnan(fbv)==0)[0]
-x  = TI[ID]
-y  = fbv[ID]
-ID = np.where(y>20)
-x  = x[ID]
-y  = y[ID]
-ID = np.where(x != x.min())[0]
-x  = x[ID]
-y  = y[ID]
-
-# Bin to monthly timescale
-from scipy import interpolate
-X = np.arange((1/12)/2,1,1/12)
-Y  = np.arange(0,len(X))
-f = interpolate.interp1d(X, Y,'nearest')
-yi = f(x)
-
-MU = np.zeros(len(X))
-for i in np.unique(yi):
-    II = len(np.where(yi==i)[0])
-    MU[int(i)] = II
+tox  = data.series('TOX4', site='LB')
+fbv  = data.series('FBV', site='LB', division='Cyanobacteria')
+
+# Blooms (FBV > 20) in each calendar month, over all years
+MU = np.zeros(12)
+for m in range(1,13):
+    y = take(fbv, data.index.months(m,m))
+    MU[m-1] = np.sum(y>20)
 MU += 1
 
 ######### Plot
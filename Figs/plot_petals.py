@@ -2,51 +2,31 @@ import numpy as np
 import matplotlib.pylab as plt
 from matplotlib.pyplot import figure, show, rc
 import matplotlib.cm as cm
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from dlake.dataset import open_dataset
 
 
 ## Data
-data = np.load("../Data/Preprocessed/Data_historical_7day.npz")
+data = open_dataset(days=7)
 time = data['TIME']
-div  = data['DIV']  # column 4 is cyanobacteria
-locs = data['LOCS'] # column 4 is the log boom
-
-tox  = data['TOX4'][:,4]
-fbv  = data['FBV'][:,4,4]
-temp = data['TEMP']
-pwi  = data['PWI']
-hum  = data['HUM']
-pres  = data['PRES']
-nut1 = data['NUT1'][:,4] # NO3+NO2
-nut2 = data['NUT2'][:,4] # O-Phos
-nut3 = data['NUT3'][:,4] # TN
-nut4 = data['NUT4'][:,4] # T_Phos
+div  = data.divisions
+locs = data.sites
+
+## Normalize data (nuts can be negative, so log10(nut+1) of nut>=0)
+tox  = data.normalized('TOX4', site='LB')
+fbv  = data.normalized('FBV', site='LB', division='Cyanobacteria')
+temp = data.normalized('TEMP')
+pwi  = data.normalized('PWI')
+hum  = data.normalized('HUM')
+pres = data.normalized('PRES')
+nut1 = data.normalized('NUT1', site='LB', log=True) # NO3+NO2
+nut2 = data.normalized('NUT2', site='LB', log=True) # O-Phos
+nut3 = data.normalized('NUT3', site='LB', log=True) # TN
+nut4 = data.normalized('NUT4', site='LB', log=True) # T_Phos
 # Algal diversity (Shannon)
 # Light level
 # Degree days
-
-## Nuts can be negative?
-nut1[nut1<0]=0
-nut2[nut2<0]=0
-nut3[nut3<0]=0
-nut4[nut4<0]=0
-
-## Log nuts
-nut1 = np.log10(nut1+1);
-nut2 = np.log10(nut2+1);
-nut3 = np.log10(nut3+1);
-nut4 = np.log10(nut4+1);
-
-## Normalize data
-tox  = tox  / np.nanmax(tox)
-fbv  = fbv  / np.nanmax(fbv)
-temp = temp / np.nanmax(temp)
-pwi  = pwi  / np.nanmax(pwi)
-hum  = hum  / np.nanmax(hum)
-pres = pres / np.nanmax(pres)
-nut1 = nut1 / np.nanmax(nut1)
-nut2 = nut2 / np.nanmax(nut2)
-nut3 = nut3 / np.nanmax(nut3)
-nut4 = nut4 / np.nanmax(nut4)
 D = np.vstack((fbv,temp,pwi,hum,pres,nut1,nut2,nut3,nut4)).transpose()
 
 ## Choose a time to plot
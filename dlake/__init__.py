@@ -0,0 +1,2 @@
+## Shared helpers for the Detroit Lake preprocessing scripts
+#! The Prediction Lab 2019
@@ -0,0 +1,354 @@
+## Dependency-tracked build, raw data -> Data/Preprocessed -> figures
+#! The Prediction Lab 2019
+#
+# Every script is a Stage: the folder it runs in, its command, the files it
+# reads and the files it writes (paths relative to the repository, globs
+# allowed). A stage depends on the stages that write what it reads. It is run
+# again only when the content of one of its inputs, of its script or of the
+# dlake modules the script imports has changed, or an output is missing, so a
+# rerun upstream that writes the same numbers stops there. Stages that don't
+# depend on each other run in parallel (each is its own python process).
+#
+# Fingerprints are sha256 of the content, for .npz files of each member
+# (np.savez stamps the zip entries with the time of writing), and are kept in
+# BUILD_DIR/state.json with the size and mtime of each file so unchanged files
+# are not hashed again. Each stage's output goes to BUILD_DIR/<stage>.log.
+import os
+import re
+import sys
+import glob
+import json
+import fnmatch
+import time
+import zipfile
+import hashlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dlake.cache import file_digest
+
+## Repository root, which all stage paths are relative to
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+## Fingerprints of the last successful run of each stage, and logs
+BUILD_DIR = ".build"
+
+
+class Stage(object):
+    """One script of the build: runs `command` in `folder`, reads `inputs`
+    and writes `outputs`
+    """
+
+    def __init__(self, name, folder, command, inputs=(), outputs=()):
+        self.name = name
+        self.folder = folder
+        self.command = list(command)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+    @property
+    def script(self):
+        return os.path.join(self.folder, self.command[0])
+
+    def __repr__(self):
+        return "Stage(%r)" % self.name
+
+
+P = "Data/Preprocessed/"
+HIST = "Data/Raw_lake/Historical/"
+SAT = "Data/Satellite/"
+
+## The build, in the order the scripts were run by hand
+STAGES = [
+    Stage("historical", "Data/Raw_lake", ["make_historical.py"],
+          [HIST + "*.xlsx"],
+          [P + "Data_historical.npz", P + "Data_historical_7day.npz",
+           P + "Data_ingested_samples.npz"]),
+    # updates the products of "historical" in place, so what reads them comes after it
+    Stage("latest", "Data/Raw_lake", ["make_latest.py"],
+          ["Data/Raw_lake/Latest/*.xlsx", P + "Data_ingested_samples.npz"],
+          [P + "Data_historical.npz", P + "Data_historical_7day.npz",
+           P + "Data_ingested_samples.npz"]),
+    Stage("gauges", "Data/Raw_lake", ["make_gauges.py"],
+          [HIST + "ApplicableUSGSStreamGauges.xlsx", "Data/Raw_lake/Gauges/*"],
+          [P + "Data_gauges.npz", P + "Data_gauges_7day.npz"]),
+    Stage("lake_locs", SAT, ["make_lake_locs.py"],
+          [SAT + "Data/LS8/L8_OLI_2018_09_03_18_56_01_046029_L2W.nc"],
+          [SAT + "Data/Data_lake_locations.npz", SAT + "Figs/Fig_map_raw655.png"]),
+    Stage("ls8_timeseries", SAT, ["make_LS8_timeseries.py"],
+          [SAT + "Data/LS8/*.nc", SAT + "Data/Data_lake_locations.npz"],
+          [SAT + "Data/Data_LS8_timeseries.npz", SAT + "Data/Data_LS8_scenes.json"]),
+    Stage("sat_figures", SAT, ["plot_timeseries.py"],
+          [SAT + "Data/Data_LS8_timeseries.npz", SAT + "Data/Data_lake_locations.npz"],
+          [SAT + "Figs/Fig_spectral_ts.png", SAT + "Figs/Fig_spectrum.png"]),
+    Stage("climatology", "Figs", ["plot_climatology.py"],
+          [P + "Data_historical_7day.npz"], ["Figs/PNG/Fig_climatology.png"]),
+    Stage("petals", "Figs", ["plot_petals.py"],
+          [P + "Data_historical_7day.npz"], ["Figs/PNG/Fig_petal.png"]),
+    Stage("prediction", "Figs", ["plot_prediction.py"],
+          [], ["Figs/PNG/Fig_prediction.png"]),
+    # BMA/make_something.py doesn't parse yet (unfinished loop), so it is left
+    # out until it does:
+    # Stage("bma", "BMA", ["make_something.py"],
+    #       [P + "Data_historical.npz"], ["BMA/Results/2000cores4tuning500.png"]),
+]
+
+
+###############################################################################
+#### Fingerprints
+
+def content_digest(path):
+    """sha256 of a file's content (of each member for .npz), or of every
+    file under a folder (store and chunk folders)
+    """
+    if os.path.isdir(path):
+        h = hashlib.sha256()
+        for folder, _, files in sorted(os.walk(path)):
+            for f in sorted(files):
+                p = os.path.join(folder, f)
+                h.update(os.path.relpath(p, path).encode())
+                h.update(content_digest(p).encode())
+        return h.hexdigest()
+    if path.endswith(".npz"):
+        try:
+            with zipfile.ZipFile(path) as z:
+                h = hashlib.sha256()
+                for name in sorted(z.namelist()):
+                    h.update(name.encode())
+                    with z.open(name) as f:
+                        for block in iter(lambda: f.read(1 << 20), b""):
+                            h.update(block)
+                return h.hexdigest()
+        except zipfile.BadZipFile:
+            pass
+    return file_digest(path)
+
+
+class Fingerprints(object):
+    """content_digest of repository files, reusing the digest of a file whose
+    size and mtime are those recorded last time
+    """
+
+    def __init__(self, root=ROOT, known=None):
+        self.root = root
+        self.known = dict(known or {})
+
+    def __call__(self, relpath):
+        """Digest of a file (None if it doesn't exist)"""
+        path = os.path.join(self.root, relpath)
+        if not os.path.exists(path):
+            self.known.pop(relpath, None)
+            return None
+        st = os.stat(path)
+        rec = self.known.get(relpath)
+        if os.path.isdir(path) or rec is None or rec[:2] != [st.st_size, st.st_mtime_ns]:
+            rec = [st.st_size, st.st_mtime_ns, content_digest(path)]
+            self.known[relpath] = rec
+        return rec[2]
+
+
+def expand(root, patterns):
+    """Repository paths matching a list of paths / glob patterns, sorted"""
+    out = set()
+    for p in patterns:
+        if glob.has_magic(p):
+            out.update(os.path.relpath(f, root) for f in glob.glob(os.path.join(root, p))
+                       if os.path.isfile(f))
+        else:
+            out.add(p)
+    return sorted(out)
+
+
+_IMPORT = re.compile(r"^\s*(?:from|import)\s+dlake\.(\w+)", re.M)
+
+
+def code_files(root, script):
+    """The script and the dlake modules it imports, directly or not"""
+    out, todo = [], [script]
+    while todo:
+        path = todo.pop()
+        if path in out or not os.path.exists(os.path.join(root, path)):
+            continue
+        out.append(path)
+        with open(os.path.join(root, path)) as f:
+            todo += [os.path.join("dlake", m + ".py") for m in _IMPORT.findall(f.read())]
+    return sorted(out)
+
+
+###############################################################################
+#### Graph
+
+def dependencies(stages):
+    """{stage name: names of the stages writing one of its inputs}"""
+    deps = {}
+    for s in stages:
+        deps[s.name] = set(w.name for w in stages if w is not s
+                           for o in w.outputs for p in s.inputs
+                           if o == p or fnmatch.fnmatch(o, p))
+    _check_acyclic(deps)
+    return deps
+
+
+def _check_acyclic(deps):
+    done, active = set(), set()
+
+    def visit(n):
+        if n in done:
+            return
+        if n in active:
+            raise ValueError("build stages depend on each other in a cycle through %r" % n)
+        active.add(n)
+        for d in deps[n]:
+            visit(d)
+        active.discard(n)
+        done.add(n)
+    for n in deps:
+        visit(n)
+
+
+def upstream(deps, names):
+    """names plus every stage they depend on"""
+    out, todo = set(), list(names)
+    while todo:
+        n = todo.pop()
+        if n not in out:
+            out.add(n)
+            todo += list(deps[n])
+    return out
+
+
+def downstream(deps, names):
+    """names plus every stage depending on them"""
+    out = set(names)
+    grew = True
+    while grew:
+        grew = False
+        for n, d in deps.items():
+            if n not in out and d & out:
+                out.add(n)
+                grew = True
+    return out
+
+
+###############################################################################
+#### Run
+
+class Build(object):
+    """Runs the stale stages of a list of Stages, recording fingerprints in
+    root/BUILD_DIR
+
+    jobs: stages run at the same time
+    """
+
+    def __init__(self, stages=STAGES, root=ROOT, jobs=None, python=sys.executable):
+        self.stages = {s.name: s for s in stages}
+        self.order = [s.name for s in stages]
+        self.root = root
+        self.jobs = jobs or os.cpu_count() or 1
+        self.python = python
+        self.deps = dependencies(stages)
+        self.state = {"stages": {}, "files": {}}
+        path = os.path.join(root, BUILD_DIR, "state.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+        self.digest = Fingerprints(root, self.state.get("files"))
+
+    def fingerprint(self, name):
+        """{file: digest} of everything a stage's result depends on"""
+        s = self.stages[name]
+        files = expand(self.root, s.inputs) + code_files(self.root, s.script)
+        fp = {p: self.digest(p) for p in files}
+        fp["command"] = " ".join(s.command)
+        return fp
+
+    def stale(self, name):
+        """Why a stage has to run (None if it's up to date)"""
+        last = self.state["stages"].get(name)
+        if last is None:
+            return "never built"
+        missing = [p for p in self.stages[name].outputs
+                   if not os.path.exists(os.path.join(self.root, p))]
+        if missing:
+            return "missing " + ", ".join(missing)
+        fp = self.fingerprint(name)
+        changed = sorted(set(k for k in set(fp) | set(last) if fp.get(k) != last.get(k)))
+        if changed:
+            return "changed " + ", ".join(changed)
+        return None
+
+    def plan(self, targets=None, force=()):
+        """{stage: reason} of the stages to run now, and the ones after them
+        that may have to (decided once their inputs are rebuilt)
+        """
+        wanted = upstream(self.deps, targets or self.order)
+        now = {}
+        for n in self.order:
+            if n in wanted:
+                why = "forced" if n in force else self.stale(n)
+                if why:
+                    now[n] = why
+        later = downstream(self.deps, now) & wanted
+        return now, {n: "after " + ", ".join(sorted(self.deps[n] & later))
+                     for n in self.order if n in later and n not in now}
+
+    def _run(self, name):
+        s = self.stages[name]
+        t = time.perf_counter()
+        with open(os.path.join(self.root, BUILD_DIR, name + ".log"), "w") as log:
+            p = subprocess.run([self.python] + s.command, cwd=os.path.join(self.root, s.folder),
+                               stdout=log, stderr=subprocess.STDOUT)
+        return p.returncode, time.perf_counter() - t
+
+    def run(self, targets=None, force=(), report=print):
+        """Run what's stale (of the targets and what they depend on), each
+        stage once everything it depends on is done. Returns {stage: result}
+        with result "ran", "up to date", "failed" or "skipped" (a stage it
+        depends on failed).
+        """
+        wanted = upstream(self.deps, targets or self.order)
+        pending = [n for n in self.order if n in wanted]
+        result = {}
+        running = {}
+        os.makedirs(os.path.join(self.root, BUILD_DIR), exist_ok=True)
+        with ThreadPoolExecutor(self.jobs) as pool:
+            while pending or running:
+                for n in list(pending):
+                    if any(d in pending or d in running.values() for d in self.deps[n] & wanted):
+                        continue
+                    pending.remove(n)
+                    if any(result.get(d) in ("failed", "skipped") for d in self.deps[n]):
+                        result[n] = "skipped"
+                        report("%-16s skipped, a stage it needs failed" % n)
+                        continue
+                    why = "forced" if n in force else self.stale(n)
+                    if why is None:
+                        result[n] = "up to date"
+                        continue
+                    report("%-16s running (%s)" % (n, why))
+                    running[pool.submit(self._run, n)] = n
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    n = running.pop(fut)
+                    code, wall = fut.result()
+                    if code == 0:
+                        # after the run: "latest" updates files it reads
+                        self.state["stages"][n] = self.fingerprint(n)
+                        result[n] = "ran"
+                        report("%-16s done in %.1fs" % (n, wall))
+                    else:
+                        self.state["stages"].pop(n, None)
+                        result[n] = "failed"
+                        report("%-16s failed (exit %d), see %s/%s.log" % (n, code, BUILD_DIR, n))
+                    self.save()
+        self.save()
+        return result
+
+    def save(self):
+        self.state["files"] = self.digest.known
+        path = os.path.join(self.root, BUILD_DIR, "state.json")
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(tmp, path)
@@ -0,0 +1,66 @@
+## Content-addressed cache of parsed workbook columns
+#! The Prediction Lab 2019
+#
+# Parsed columns are stored as uncompressed .npz files named after a hash of
+# the workbook's content and of the read parameters, so a cached entry is
+# reused until the workbook (or what we read from it) changes.
+import os
+import json
+import hashlib
+import numpy as np
+
+## Bump when the parsing itself changes, to invalidate old entries
+CACHE_VERSION = 2
+
+
+def file_digest(path, blocksize=1 << 20):
+    """sha256 of a file's content"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_key(path, *params):
+    """Key from the file content plus any (json serialisable) read parameters"""
+    h = hashlib.sha256()
+    h.update(file_digest(path).encode())
+    h.update(json.dumps([CACHE_VERSION] + list(params), sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def save_columns(path, cols):
+    """Save {key: array} without pickling (string columns are stored as unicode)"""
+    out = {}
+    objects = []
+    for k, a in cols.items():
+        if a.dtype == object:
+            objects.append(k)
+            a = a.astype(str)
+        out[k] = a
+    out["__object__"] = np.asarray(objects, dtype=str)
+    tmp = "%s.%d.tmp.npz" % (path, os.getpid())
+    np.savez(tmp, **out)
+    os.replace(tmp, path)
+
+
+def load_columns(path):
+    """Inverse of save_columns"""
+    with np.load(path) as data:
+        objects = set(data["__object__"].tolist())
+        return {k: data[k].astype(object) if k in objects else data[k]
+                for k in data.files if k != "__object__"}
+
+
+def cached_columns(cache_dir, key, parse):
+    """Columns stored under key in cache_dir, or parse() them and store them
+    Returns (columns, whether they came from the cache)
+    """
+    path = os.path.join(cache_dir, key + ".npz")
+    if os.path.exists(path):
+        return load_columns(path), True
+    cols = parse()
+    os.makedirs(cache_dir, exist_ok=True)
+    save_columns(path, cols)
+    return cols, False
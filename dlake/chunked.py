@@ -0,0 +1,175 @@
+## Time-partitioned, compressed store for the preprocessed products
+#! The Prediction Lab 2019
+#
+# A product saved as a folder with one compressed chunk per calendar year of
+# TIME plus the arrays without a time axis (LOCS, DIV) and manifest.json, eg.
+#   Data_historical.chunks/2013.npz ... 2019.npz, static.npz, manifest.json
+# Reading a date range only opens the chunks overlapping it, and rewriting a
+# product only writes the chunks whose content changed (usually the newest).
+import os
+import json
+import hashlib
+import numpy as np
+from dlake.timeconv import datetime2year
+
+MANIFEST = "manifest.json"
+STATIC = "static.npz"
+CHUNKED_VERSION = 1
+
+## Arrays without a time axis (as are scalars and anything not the length of TIME)
+STATIC_KEYS = ("LOCS", "DIV")
+
+
+def _digest(arrays):
+    """Hash of a set of arrays (names, dtypes, shapes and values)"""
+    h = hashlib.sha256()
+    for k in sorted(arrays):
+        a = np.ascontiguousarray(arrays[k])
+        h.update(("%s %s %s" % (k, a.dtype.str, a.shape)).encode())
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+def _write_npz(path, arrays):
+    tmp = "%s.%d.tmp.npz" % (path[:-len(".npz")], os.getpid())
+    np.savez_compressed(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+def save_chunked(path, arrays, **info):
+    """Write {key: array} (time along axis 0, except LOCS, DIV etc.) as yearly
+    chunks at path. Chunks whose content is unchanged are not rewritten.
+    Returns the list of files written.
+    """
+    os.makedirs(path, exist_ok=True)
+    old = {}
+    if os.path.exists(os.path.join(path, MANIFEST)):
+        with open(os.path.join(path, MANIFEST)) as f:
+            previous = json.load(f)
+        old = {c["file"]: c["hash"] for c in previous["chunks"]}
+        old[STATIC] = previous["static"]["hash"]
+
+    TIME = np.asarray(arrays["TIME"])
+    arrays = {k: np.asarray(a) for k, a in arrays.items()}
+    static = {k: a.astype(str) if a.dtype == object else a for k, a in arrays.items()
+              if k in STATIC_KEYS or a.ndim == 0 or len(a) != len(TIME)}
+    series = {k: a for k, a in arrays.items() if k not in static}
+    years = np.floor(TIME).astype(int)
+    bounds = np.flatnonzero(np.diff(years)) + 1
+    starts = np.concatenate(([0], bounds))
+    stops = np.concatenate((bounds, [len(TIME)]))
+
+    written = []
+    manifest = dict(version=CHUNKED_VERSION, layout="chunks", chunking="year", chunks=[],
+                    arrays={k: dict(dtype=a.dtype.str, shape=list(a.shape))
+                            for k, a in series.items()}, **info)
+    h = _digest(static)
+    manifest["static"] = dict(file=STATIC, hash=h,
+                              arrays={k: dict(dtype=a.dtype.str, shape=list(a.shape))
+                                      for k, a in static.items()})
+    if old.get(STATIC) != h or not os.path.exists(os.path.join(path, STATIC)):
+        _write_npz(os.path.join(path, STATIC), static)
+        written.append(STATIC)
+
+    for start, stop in zip(starts, stops):
+        chunk = {k: a[start:stop] for k, a in series.items()}
+        name = "%d.npz" % years[start]
+        h = _digest(chunk)
+        if old.get(name) != h or not os.path.exists(os.path.join(path, name)):
+            _write_npz(os.path.join(path, name), chunk)
+            written.append(name)
+        manifest["chunks"].append(dict(file=name, year=int(years[start]), start=int(start),
+                                       stop=int(stop), tmin=float(TIME[start]),
+                                       tmax=float(TIME[stop - 1]), hash=h))
+
+    tmp = os.path.join(path, "%s.%d.tmp" % (MANIFEST, os.getpid()))
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, os.path.join(path, MANIFEST))
+
+    # drop chunks no longer in the product
+    keep = set(c["file"] for c in manifest["chunks"]) | {STATIC}
+    for name in set(old) - keep:
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+    return written
+
+
+def _as_year(t):
+    """Decimal years from decimal years, datetimes, datetime64 or 'YYYY-MM-DD'"""
+    if t is None or isinstance(t, (int, float, np.floating, np.integer)):
+        return t
+    return float(datetime2year(np.datetime64(t) if isinstance(t, str) else t))
+
+
+class ChunkedStore(object):
+    """Read-only view of a chunked product
+
+    data = ChunkedStore("Data_historical.chunks")
+    data.files                              -> keys
+    data['FBV']                             -> whole record (every chunk)
+    data.read('FBV', '2018-05-01', '2018-10-01')  -> only the 2018 chunk
+    data.select('2018-05-01', '2018-10-01') -> {key: rows in that range}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.chunks = self.manifest["chunks"]
+        self.files = list(self.manifest["static"]["arrays"]) + list(self.manifest["arrays"])
+        self._loaded = {}
+
+    def _member(self, file, key):
+        """One array of a chunk file, decompressed once (the others aren't read)"""
+        if (file, key) not in self._loaded:
+            with np.load(os.path.join(self.path, file)) as d:
+                self._loaded[file, key] = d[key]
+        return self._loaded[file, key]
+
+    def chunks_between(self, start=None, end=None):
+        """Chunks with rows in [start, end] (decimal years or dates, None = open)"""
+        start, end = _as_year(start), _as_year(end)
+        return [c for c in self.chunks
+                if (start is None or c["tmax"] >= start) and (end is None or c["tmin"] <= end)]
+
+    def read(self, key, start=None, end=None):
+        """Rows of key with TIME in [start, end], reading only the overlapping chunks"""
+        if key in self.manifest["static"]["arrays"]:
+            return self._member(STATIC, key)
+        chunks = self.chunks_between(start, end)
+        if not chunks:
+            entry = self.manifest["arrays"][key]
+            return np.empty([0] + entry["shape"][1:], dtype=entry["dtype"])
+        a = np.concatenate([self._member(c["file"], key) for c in chunks])
+        if start is None and end is None:
+            return a
+        TIME = np.concatenate([self._member(c["file"], "TIME") for c in chunks])
+        ok = np.ones(len(TIME), dtype=bool)
+        if start is not None:
+            ok &= TIME >= _as_year(start)
+        if end is not None:
+            ok &= TIME <= _as_year(end)
+        return a[ok]
+
+    def select(self, start=None, end=None, keys=None):
+        """{key: rows in [start, end]} for keys (default all)"""
+        return {k: self.read(k, start, end) for k in (keys or self.files)}
+
+    def __getitem__(self, key):
+        return self.read(key)
+
+    def __contains__(self, key):
+        return key in self.files
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._loaded = {}
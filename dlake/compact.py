@@ -0,0 +1,131 @@
+## Compact dtypes for the preprocessed products, with declared precision
+#! The Prediction Lab 2019
+#
+# Opt-in (make_historical.py --compact). Each variable declares how it is
+# stored and how much it may lose:
+#   ("int16", 0.001)  scaled integer, value = stored * 0.001, so every value
+#                     must be a multiple of 0.001 (and in range) to be kept,
+#                     NaN kept as the dtype's smallest value
+#   ("float32", None) float32, relative error below FLOAT32_RTOL
+# encode_product checks every value against the declaration and refuses to
+# produce a product that would change one (ValueError), eg. a 4 decimal value
+# in a 3 decimal variable.
+import numpy as np
+
+## Stored dtype and step of each variable (variables not listed stay as they are)
+PRECISION = {
+    # mg/L to 3 decimals, phosphates to 4 (NUT3 goes past the +-32.767 range
+    # of int16, the phosphates stay below 3.2767)
+    "NUT1": ("int16", 0.001), "NUT2": ("int16", 0.0001),
+    "NUT3": ("int32", 0.001), "NUT4": ("int16", 0.0001),
+    # ppb, some are averages of replicates so no fixed number of decimals
+    "TOX1": ("float32", None), "TOX2": ("float32", None),
+    "TOX3": ("float32", None), "TOX4": ("float32", None),
+    # cells/mL, um3/mL and % span many orders of magnitude
+    "DEN": ("float32", None), "TBV": ("float32", None), "FBV": ("float32", None),
+    # station readings are to 2 decimals, so their min, max and totals over a
+    # step are too (rain totals need int32); means over a step are not
+    "TEMP_MIN": ("int16", 0.01), "TEMP_MAX": ("int16", 0.01),
+    "HUM_MIN": ("int16", 0.01), "HUM_MAX": ("int16", 0.01),
+    "PWI": ("int16", 0.01), "RAIN": ("int32", 0.01),
+    "TEMP": ("float32", None), "HUM": ("float32", None),
+    "WIS": ("float32", None), "PRES": ("float32", None),
+}
+
+## Relative error allowed by float32 (half an ulp is 2**-24 ~ 6e-8)
+FLOAT32_RTOL = 1e-7
+
+## Error allowed for scaled integers, as a fraction of the step (float noise
+## in values read as eg. 0.058000000000000003)
+STEP_RTOL = 1e-6
+
+
+def _encode(a, dtype, step):
+    if step is None:
+        return a.astype(dtype)
+    info = np.iinfo(dtype)
+    q = np.round(a / step)
+    q = np.clip(np.where(np.isnan(q), info.min, q), info.min, info.max)
+    return q.astype(dtype)
+
+
+def _decode(q, step):
+    if step is None:
+        return q.astype(float)
+    # q / 1000 rather than q * 0.001, so 58 comes back as exactly 0.058
+    return np.where(q == np.iinfo(q.dtype).min, np.nan, q / np.round(1 / step))
+
+
+def check_precision(key, a, q):
+    """Raise ValueError if the stored q of variable key doesn't give back a,
+    within float32 error or float noise on a multiple of the step
+    """
+    dtype, step = PRECISION[key]
+    b = _decode(q, step)
+    if not np.array_equal(np.isnan(a), np.isnan(b)):
+        raise ValueError("%s: missing values not preserved as %s" % (key, dtype))
+    ok = ~np.isnan(a)
+    err = np.abs(b[ok] - a[ok])
+    if step is None:
+        tol = FLOAT32_RTOL * np.abs(a[ok])
+        declared = "relative %g" % FLOAT32_RTOL
+    else:
+        tol = np.full(err.shape, step * STEP_RTOL)
+        declared = "steps of %g" % step
+    if np.any(err > tol):
+        i = np.argmax(err - tol)
+        raise ValueError("%s: %r can't be stored as %s in %s (off by %g)"
+                         % (key, a[ok][i], dtype, declared, err[i]))
+
+
+def encode_product(arrays):
+    """Product with the PRECISION variables in their compact dtypes, after
+    checking each against its declared precision. Scaled integers carry
+    <KEY>_scale, and COMPACT lists them (see decode_product).
+    """
+    out, scaled = {}, []
+    for k, a in arrays.items():
+        if k not in PRECISION:
+            out[k] = a
+            continue
+        dtype, step = PRECISION[k]
+        a = np.asarray(a, dtype=float)
+        q = _encode(a, dtype, step)
+        check_precision(k, a, q)
+        out[k] = q
+        if step is not None:
+            out[k + "_scale"] = np.array(step)
+            scaled.append(k)
+    out["COMPACT"] = np.array(scaled)
+    return out
+
+
+def decode_product(arrays):
+    """Inverse of encode_product: every variable back to float64"""
+    scaled = [str(k) for k in arrays["COMPACT"]]
+    out = {}
+    for k, a in arrays.items():
+        if k == "COMPACT" or (k.endswith("_scale") and k[:-len("_scale")] in scaled):
+            continue
+        if k in scaled:
+            out[k] = _decode(np.asarray(a), float(arrays[k + "_scale"]))
+        elif np.asarray(a).dtype == np.float32:
+            out[k] = np.asarray(a, dtype=float)
+        else:
+            out[k] = a
+    return out
+
+
+def decode_values(data, key, a):
+    """Values a of variable key (all or part of it, as stored) of an open
+    product as float64, compact or not
+    """
+    a = np.asarray(a)
+    if "COMPACT" in data and key in [str(k) for k in data["COMPACT"]]:
+        return _decode(a, float(data[key + "_scale"]))
+    return a.astype(float) if a.dtype == np.float32 else a
+
+
+def decode_array(data, key):
+    """One variable of an open product (npz, store) as float64, compact or not"""
+    return decode_values(data, key, data[key])
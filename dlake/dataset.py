@@ -0,0 +1,196 @@
+## Lazy, cached access to the preprocessed lake and satellite products
+#! The Prediction Lab 2019
+#
+# data = open_dataset(days=7)
+# data['TIME']                                          -> whole variable
+# data.series('FBV', site='LB', division='Cyanobacteria') -> instead of [:,4,4]
+# data.normalized('NUT1', site='LB', log=True)         -> log10(x+1) / max
+# data.reflectance('655', location=1)                   -> LS8 COL[:,3,1]
+# data.series('TOX4', site='LB')[data.index.season('JJA')[0]]  (see dlake.timeindex)
+# Products are opened on first use and stay lazy: a series is indexed out of
+# the stored variable (memory mapped for a store folder) before it is decoded
+# and copied, so only that slice is read. Variables and series are kept in a
+# small LRU cache, and open_dataset hands every script in a process the same
+# handle.
+import os
+from collections import OrderedDict
+import numpy as np
+from dlake.store import open_store
+from dlake.compact import decode_values
+from dlake.historical import output_name
+from dlake.timeindex import TimeIndex
+
+## Data/Preprocessed of this repository
+PREPROCESSED = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            "Data", "Preprocessed")
+
+## Data/Satellite/Data, where make_LS8_timeseries.py and make_lake_locs.py write
+SATELLITE_DATA = os.path.join(os.path.dirname(PREPROCESSED), "Satellite", "Data")
+
+## Satellite products (in SATELLITE_DATA)
+SATELLITE = "Data_LS8_timeseries.npz"
+SAT_LOCATIONS = "Data_lake_locations.npz"
+
+
+def _index(names, key, what):
+    """Position of key (a name, or already an index) in names"""
+    if isinstance(key, (int, np.integer)):
+        return int(key)
+    names = [str(n) for n in names]
+    if key not in names:
+        raise KeyError("unknown %s %r, expected one of %s" % (what, key, ", ".join(names)))
+    return names.index(key)
+
+
+class DetroitLakeDataset(object):
+    """Handle on the Data_historical* product of one resolution, in root
+    (default Data/Preprocessed), plus the satellite time series, in sat_root
+    (default Data/Satellite/Data)
+
+    cache_size: number of derived series kept (least recently used go first)
+    """
+
+    def __init__(self, root=PREPROCESSED, days=7, cache_size=64, sat_root=SATELLITE_DATA):
+        self.root = root
+        self.sat_root = sat_root
+        self.days = days
+        self.cache_size = cache_size
+        self._products = {}
+        self._variables = {}
+        self._indexes = {}
+        self._cache = OrderedDict()
+
+    def _product(self, name):
+        if name not in self._products:
+            if name == "historical":
+                path = os.path.join(self.root, output_name(self.days)[:-len(".npz")])
+            else:
+                path = os.path.join(self.sat_root, name)
+            self._products[name] = open_store(path)
+        return self._products[name]
+
+    def _stored(self, key, product):
+        """Variable as stored (not read yet for a store folder), opened once"""
+        if (product, key) not in self._variables:
+            self._variables[product, key] = self._product(product)[key]
+        return self._variables[product, key]
+
+    def sel(self, key, index=Ellipsis, product="historical"):
+        """Part of a variable (any numpy index), only that part read and decoded"""
+        a = self._stored(key, product)[index]
+        return np.array(decode_values(self._product(product), key, a))
+
+    def get(self, key, product="historical"):
+        """Variable key of a product ("historical", SATELLITE or SAT_LOCATIONS),
+        cached (read only, as it is shared)
+        """
+        return self._cached(("get", product, key), lambda: self.sel(key, product=product))
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    @property
+    def files(self):
+        return list(self._product("historical").files)
+
+    ## Names for the axes
+    @property
+    def sites(self):
+        return [str(s) for s in self["LOCS"]]
+
+    @property
+    def divisions(self):
+        return [str(d) for d in self["DIV"]]
+
+    @property
+    def bands(self):
+        return [str(b) for b in self.get("BANDS", SATELLITE)]
+
+    @property
+    def time(self):
+        return self["TIME"]
+
+    @property
+    def sat_time(self):
+        return self.get("TIME", SATELLITE)
+
+    @property
+    def index(self):
+        """TimeIndex of TIME (date, range, season queries as slices)"""
+        if "historical" not in self._indexes:
+            self._indexes["historical"] = TimeIndex(self.time)
+        return self._indexes["historical"]
+
+    @property
+    def sat_index(self):
+        """TimeIndex of the LS8 scene times"""
+        if SATELLITE not in self._indexes:
+            self._indexes[SATELLITE] = TimeIndex(self.sat_time)
+        return self._indexes[SATELLITE]
+
+    @property
+    def sat_locations(self):
+        """(lon, lat) of the satellite sample points"""
+        return self.get("LOCS", SAT_LOCATIONS)
+
+    ## Derived series, LRU cached
+    def _cached(self, key, make):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        a = make()
+        a.setflags(write=False)
+        self._cache[key] = a
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return a
+
+    def series(self, var, site=None, division=None):
+        """var at a site (and division for DEN, TBV, FBV), by name or index"""
+        def make():
+            index = (slice(None),)
+            if site is not None:
+                index += (_index(self["LOCS"], site, "site"),)
+            if division is not None:
+                index += (Ellipsis, _index(self["DIV"], division, "division"))
+            return self.sel(var, index)
+        return self._cached(("series", var, site, division), make)
+
+    def normalized(self, var, site=None, division=None, log=False):
+        """series / its max; log: log10 of the series (negatives as 0) plus 1 first"""
+        def make():
+            a = self.series(var, site, division)
+            if log:
+                a = np.log10(np.where(a < 0, 0, a) + 1)
+            return a / np.nanmax(a)
+        return self._cached(("normalized", var, site, division, log), make)
+
+    def reflectance(self, band, location=None):
+        """LS8 reflectance of a band (name, eg. '655', or index) at a location"""
+        def make():
+            index = (slice(None), _index(self.bands, band, "band"))
+            if location is not None:
+                index += (location,)
+            return self.sel("COL", index, SATELLITE)
+        return self._cached(("reflectance", band, location), make)
+
+    def close(self):
+        for data in self._products.values():
+            if hasattr(data, "close"):
+                data.close()
+        self._products = {}
+        self._variables = {}
+        self._indexes = {}
+        self._cache.clear()
+
+
+## One handle per (root, days, sat_root) per process
+_open = {}
+
+
+def open_dataset(root=PREPROCESSED, days=7, cache_size=64, sat_root=SATELLITE_DATA):
+    """Shared DetroitLakeDataset for root, days and sat_root"""
+    key = (os.path.abspath(root), days, os.path.abspath(sat_root))
+    if key not in _open:
+        _open[key] = DetroitLakeDataset(root, days, cache_size, sat_root)
+    return _open[key]
@@ -0,0 +1,138 @@
+## USGS stream gauge series, streamed and reduced onto the TIME grid
+#! The Prediction Lab 2019
+#
+# Gauges are listed in Historical/ApplicableUSGSStreamGauges.xlsx. Their
+# instantaneous (15 minute) exports from https://waterdata.usgs.gov/nwis/uv,
+# tab separated "rdb" files optionally gzipped, are kept as
+#   ./Gauges/<site number>.rdb[.gz]
+# The files are read a block of lines at a time and every block is folded into
+# per-bin accumulators (regrid.BinReducer), so memory stays the size of the
+# TIME grid whatever the length of the record. Times are taken as the local
+# clock times of the export, like the lake samples.
+import os
+import gzip
+import numpy as np
+from dlake.xlsx import read_sheet
+from dlake.sites import site_codes
+from dlake.report import stage
+from dlake.regrid import BinReducer
+
+## Gauge list in the Historical folder
+GAUGES_WORKBOOK = "ApplicableUSGSStreamGauges.xlsx"
+
+## USGS parameter codes we keep, and the product variable for each
+PARAMETERS = {"00060": "FLOW",   # discharge (ft3/s)
+              "00010": "WTEMP",  # water temperature (C)
+              "00065": "GAGE"}   # gage height (ft)
+
+## Statistics per bin, saved as <VARIABLE>_<STAT>, eg. FLOW_MEAN
+STATS = ("MEAN", "MAX", "SUM")
+
+## Lines parsed at a time
+BLOCK = 100000
+
+
+def load_gauges(folder="./Historical", cache_dir=None):
+    """(site numbers, names) of the gauges in the gauge workbook"""
+    cols = read_sheet(os.path.join(folder, GAUGES_WORKBOOK), "Aplicable USGS Gauging Sites",
+                      {"site": "Site Number", "name": "Site Name"}, cache_dir=cache_dir)
+    ok = np.isnan(np.asarray(cols["site"], dtype=float)) == 0
+    return [str(s) for s in site_codes(cols["site"][ok])], [str(n) for n in cols["name"][ok]]
+
+
+def gauge_file(folder, site):
+    """Export of a gauge in folder (None if there is none)"""
+    for ext in (".rdb", ".rdb.gz", ".txt", ".txt.gz"):
+        path = os.path.join(folder, site + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _floats(values):
+    """Floats from rdb cells ('' and flags such as Ice, Eqp, *** are NaN)"""
+    try:
+        return np.array(values, dtype=float)
+    except ValueError:
+        out = np.full(len(values), np.nan)
+        for i, v in enumerate(values):
+            try:
+                out[i] = float(v)
+            except ValueError:
+                pass
+        return out
+
+
+def read_rdb(path, block=BLOCK):
+    """Blocks of an rdb export: yields (datetime64[m] array, {VARIABLE: values})"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        header = None
+        for line in f:
+            if not line.startswith("#"):
+                header = line.rstrip("\n").split("\t")
+                next(f)  # field widths / types line
+                break
+        if header is None:
+            return
+        time_col = header.index("datetime")
+        columns = {}
+        for j, name in enumerate(header):
+            parts = name.split("_")
+            if len(parts) == 2 and parts[1] in PARAMETERS and PARAMETERS[parts[1]] not in columns:
+                columns[PARAMETERS[parts[1]]] = j
+
+        rows = []
+        for line in f:
+            if not line.strip():
+                continue
+            rows.append(line.rstrip("\n").split("\t"))
+            if len(rows) == block:
+                yield _block(rows, time_col, columns)
+                rows = []
+        if rows:
+            yield _block(rows, time_col, columns)
+
+
+def _block(rows, time_col, columns):
+    ncol = max([time_col] + list(columns.values())) + 1
+    rows = [r + [""] * (ncol - len(r)) for r in rows]
+    when = np.array([r[time_col].replace(" ", "T") for r in rows], dtype="datetime64[m]")
+    return when, {v: _floats([r[j] for r in rows]) for v, j in columns.items()}
+
+
+def reduce_gauges(sites, folder, grids):
+    """Stream every gauge's export onto each TIME grid. Returns one dict per
+    grid: GAUGES (site numbers), TIME and <VARIABLE>_<STAT> arrays (time, gauge).
+    Gauges without an export are all NaN.
+    """
+    outs = [{"GAUGES": list(sites), "TIME": TIME} for TIME in grids]
+    for v in PARAMETERS.values():
+        for out, TIME in zip(outs, grids):
+            for s in STATS:
+                out["%s_%s" % (v, s)] = np.full((len(TIME), len(sites)), np.nan)
+    for g, site in enumerate(sites):
+        path = gauge_file(folder, site)
+        if path is None:
+            continue
+        reducers = [BinReducer(TIME) for TIME in grids]
+        with stage("gauge", file=path) as rec:
+            rows = 0
+            for when, values in read_rdb(path):
+                rows += len(when)
+                for r in reducers:
+                    r.add(when, values)
+            rec["rows"] = rows
+        for out, r in zip(outs, reducers):
+            for v in PARAMETERS.values():
+                stats = r.result(v)
+                for s in STATS:
+                    out["%s_%s" % (v, s)][:, g] = stats[s]
+    return outs
+
+
+def gauge_output_name(days):
+    """Data_gauges.npz for daily data, Data_gauges_<n>day.npz otherwise"""
+    if days == 1:
+        return "Data_gauges.npz"
+    return "Data_gauges_%gday.npz" % days
@@ -0,0 +1,54 @@
+## Group-by index for slicing sample tables by site / division
+#! The Prediction Lab 2019
+import numpy as np
+
+
+class GroupIndex(object):
+    """Sample table sorted once by group (and by time within each group)
+
+    Built with a single sort, after which the samples of group g are the
+    contiguous slice index.slice(g) of any column passed through index.take,
+    so no per-group scan of the full table is needed.
+
+    group: group number of each sample in 0..ngroups-1 (negative = ignore sample)
+    ngroups: number of groups
+    t: optional sample times, used to order samples within a group (stable)
+    """
+
+    def __init__(self, group, ngroups, t=None):
+        group = np.asarray(group)
+        keep = np.where(group >= 0)[0]
+        if t is None:
+            order = np.argsort(group[keep], kind="mergesort")
+        else:
+            order = np.lexsort((np.asarray(t)[keep], group[keep]))
+        self.order = keep[order]
+        self.group = group[self.order]
+        self.ngroups = ngroups
+        self.counts = np.bincount(self.group, minlength=ngroups)
+        self.offsets = np.concatenate(([0], np.cumsum(self.counts)))
+
+    @classmethod
+    def from_keys(cls, keys, shape, t=None):
+        """Index on several integer keys at once, eg. (site, division) codes
+        with shape (number of sites, number of divisions). Samples with any
+        negative key are ignored.
+        """
+        keys = [np.asarray(k) for k in keys]
+        bad = np.zeros(len(keys[0]), dtype=bool)
+        for k in keys:
+            bad |= k < 0
+        group = np.ravel_multi_index([np.where(bad, 0, k) for k in keys], shape)
+        group[bad] = -1
+        return cls(group, int(np.prod(shape)), t)
+
+    def __len__(self):
+        return self.ngroups
+
+    def take(self, a):
+        """Column a (in original row order) reordered by group"""
+        return np.asarray(a)[self.order]
+
+    def slice(self, g):
+        """Slice of the reordered columns holding group g"""
+        return slice(self.offsets[g], self.offsets[g + 1])
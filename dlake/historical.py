@@ -0,0 +1,370 @@
+## Resampling engine for the historical Detroit Lake data
+#! The Prediction Lab 2019
+#
+# The raw workbooks are parsed once (load_raw) and the samples can then be
+# put on any number of TIME grids (resample), eg. daily and weekly in one run.
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from dlake.xlsx import read_sheet, iter_sheet
+from dlake.cache import save_columns, load_columns, cache_key, cached_columns
+from dlake.groupby import GroupIndex
+from dlake.regrid import regrid_nearest, BinReducer
+from dlake.store import save_store
+from dlake.chunked import save_chunked
+from dlake.sparse import save_sparse, sparse_name
+from dlake.compact import encode_product
+from dlake.report import RunReport, activate, stage
+from dlake.timeconv import datetime2year, time_grid, TIME_START, TIME_END
+from dlake.sites import site_index
+
+## Locations we care about (the default site list, see dlake.sites)
+LOCS = ['BB','BO','HA','HT','LB','LBP','LBS']
+
+## Keys of the Data_historical*.npz products, in save order
+# Locations: LOCS = ['BB','BO','HA','HT','LB','LBP','LBS']
+# TIME: decimal years (at midday)
+# NUT1: NO3+NO2 (mg/L)
+# NUT2: O-Phos (mg/L)
+# NUT3: TN (mg/L)
+# NUT4: T-Phos (mg/L)
+# TOX1: LCMSMS Cylindro (ppb)
+# TOX2: LCMSMS Microcystin (ppb)
+# TOX3: ELISA Cylindro (ppb)
+# TOX4: ELISA Microcystin (ppb)
+# DIV: bacterial/algal family name
+# DEN: algal concentration
+# TBV: total biovolume
+# FBV: fractional biovolume
+# TEMP, TEMP_MIN, TEMP_MAX: mean, min, max temperature over each TIME step
+# HUM, HUM_MIN, HUM_MAX: mean, min, max humidity
+# PWI: max peak wind speed
+# WIS: mean wind speed
+# RAIN: total rain
+# PRES: mean barometric pressure
+KEYS = ['LOCS','TIME','NUT1','NUT2','NUT3','NUT4','TOX1','TOX2','TOX3','TOX4',
+        'DIV','DEN','TBV','FBV','TEMP','TEMP_MIN','TEMP_MAX','HUM','HUM_MIN','HUM_MAX',
+        'PWI','WIS','RAIN','PRES']
+
+
+###############################################################################
+#### Parse raw workbooks
+
+def load_nutrients(folder, cache_dir=None):
+    cols = read_sheet(os.path.join(folder, "Nutrients.xlsx"), "Nutrients",
+                      {"time": "DateTime", "loc": "Site Location",
+                       "nut1": "NO3+NO2 (mg/L)", "nut2": "O-Phos (mg/L)",
+                       "nut3": "TN (mg/L)", "nut4": "T-Phos (mg/L)"}, cache_dir=cache_dir)
+    cols["time"] = datetime2year(cols["time"])
+    return cols
+
+
+def load_toxins(folder, cache_dir=None):
+    toxcols = {"time": "Date/Time", "loc": "Site Location",
+               "cyl": "Cylindro (ppb)", "mic": "Microcystin (ppb)"}
+    path = os.path.join(folder, "CyanotoxinConcentrations.xlsx")
+    raw = {}
+    for sheet in ["LCMSMS", "ELISA"]:
+        cols = read_sheet(path, sheet, toxcols, cache_dir=cache_dir)
+        cols["time"] = datetime2year(cols["time"])
+        raw[sheet] = cols
+    return raw
+
+
+def load_algae(folder, cache_dir=None):
+    cols = read_sheet(os.path.join(folder, "Algae Speciation.xlsx"), "PrioritySites",
+                      {"time": "Date", "loc": "Site Location", "gen": "GENUS",
+                       "div": "DIVISION", "tal": "TALLY", "den": "DENSITY (cells/mL)",
+                       "tbv": "TOTAL BV (um3/mL)", "fbv": "% BIOVOLUME"}, cache_dir=cache_dir)
+    cols["time"] = datetime2year(cols["time"])
+    return cols
+
+
+## Weather station sheet: columns, and the statistic over each TIME step of each variable
+WEATHER = ("Weather data.xlsx", "Weather-BureauRecl Detroit Lake",
+           {"time": "A", "tem": "B", "hum": "C", "pwi": "F", "wis": "G", "rain": "I", "pres": "J"})
+WEATHER_STATS = [("TEMP", "tem", "MEAN"), ("TEMP_MIN", "tem", "MIN"), ("TEMP_MAX", "tem", "MAX"),
+                 ("HUM", "hum", "MEAN"), ("HUM_MIN", "hum", "MIN"), ("HUM_MAX", "hum", "MAX"),
+                 ("PWI", "pwi", "MAX"), ("WIS", "wis", "MEAN"), ("RAIN", "rain", "SUM"),
+                 ("PRES", "pres", "MEAN")]
+
+
+def load_weather(folder, cache_dir=None):
+    """Station readings, missing ones NaN (times kept as datetime64 for binning)"""
+    book, sheet, columns = WEATHER
+    fields = [k for k in columns if k != "time"]
+    return read_sheet(os.path.join(folder, book), sheet, columns, skip_footer=1,
+                      dtypes=dict.fromkeys(fields, float), cache_dir=cache_dir)
+
+
+def weather_blocks(folder, block=10000):
+    """The station sheet a block of readings at a time (see reduce_weather),
+    for hourly or finer feeds that are not worth holding in memory
+    """
+    book, sheet, columns = WEATHER
+    fields = [k for k in columns if k != "time"]
+    return iter_sheet(os.path.join(folder, book), sheet, columns, skip_footer=1,
+                      dtypes=dict.fromkeys(fields, float), block=block)
+
+
+def load_raw(folder="./Historical", cache_dir=None):
+    """Parse every raw workbook once, returns {source: columns}
+    With a cache_dir only workbooks that changed since the last run are parsed.
+    """
+    return {source: load(folder, cache_dir) for source, (load, _) in SOURCES.items()}
+
+
+###############################################################################
+#### Interpolate onto a TIME grid
+
+def index_samples(raw, sites=LOCS):
+    """Group index of the samples of every source in raw (by site, and site x
+    division for the algae), built once and shared by all resolutions.
+    sites: the site list, samples of other sites are left out
+    """
+    index = {"SITES": list(sites)}
+    if "NUTRIENTS" in raw:
+        r = raw["NUTRIENTS"]
+        index["NUTRIENTS"] = GroupIndex(site_index(r["loc"], sites), len(sites), r["time"])
+    if "TOXINS" in raw:
+        index["TOXINS"] = {sheet: GroupIndex(site_index(r["loc"], sites), len(sites), r["time"])
+                           for sheet, r in raw["TOXINS"].items()}
+    if "ALGAE" in raw:
+        r = raw["ALGAE"]
+        udiv, jdiv = np.unique(r["div"], return_inverse=True)
+        index["ALGAE"] = GroupIndex.from_keys((site_index(r["loc"], sites), jdiv),
+                                              (len(sites), len(udiv)), r["time"])
+        index["DIV"] = udiv
+    return index
+
+
+def resample_nutrients(raw, index, TIME):
+    r = raw["NUTRIENTS"]
+    N = regrid_nearest(index["NUTRIENTS"], r["time"],
+                       np.column_stack((r["nut1"], r["nut2"], r["nut3"], r["nut4"])),
+                       TIME, min_samples=1)
+    return dict(NUT1=N[:,:,0], NUT2=N[:,:,1], NUT3=N[:,:,2], NUT4=N[:,:,3])
+
+
+def resample_toxins(raw, index, TIME):
+    out = {}
+    for sheet, keys in [("LCMSMS", ("TOX1", "TOX2")), ("ELISA", ("TOX3", "TOX4"))]:
+        r = raw["TOXINS"][sheet]
+        N = regrid_nearest(index["TOXINS"][sheet], r["time"],
+                           np.column_stack((r["cyl"], r["mic"])), TIME, min_samples=3)
+        out[keys[0]], out[keys[1]] = N[:,:,0], N[:,:,1]
+    return out
+
+
+def resample_algae(raw, index, TIME):
+    r = raw["ALGAE"]
+    ix, udiv, nsites = index["ALGAE"], index["DIV"], len(index["SITES"])
+    N = regrid_nearest(ix, r["time"], np.column_stack((r["den"], r["tbv"], r["fbv"])),
+                       TIME, min_samples=1)
+    N = N.reshape((len(TIME), nsites, len(udiv), 3))
+    # only sites with more than 3 samples in total
+    nsite = ix.counts.reshape((nsites, len(udiv))).sum(1)
+    N[:, nsite <= 3] = np.nan
+    return dict(DIV=udiv, DEN=N[...,0], TBV=N[...,1], FBV=N[...,2])
+
+
+def reduce_weather(blocks, grids):
+    """Weather variables (WEATHER_STATS) of every step of each TIME grid, in one
+    pass over blocks of readings ({"time": datetime64, field: values})
+    """
+    reducers = [BinReducer(TIME) for TIME in grids]
+    for cols in blocks:
+        values = {f: cols[f] for f in set(f for _, f, _ in WEATHER_STATS)}
+        for r in reducers:
+            r.add(cols["time"], values)
+    outs = []
+    for r in reducers:
+        stats = {f: r.result(f) for f in set(f for _, f, _ in WEATHER_STATS)}
+        outs.append({k: stats[f][s] for k, f, s in WEATHER_STATS})
+    return outs
+
+
+def resample_weather(raw, index, TIME):
+    return reduce_weather([raw["WEATHER"]], [TIME])[0]
+
+
+## Each independent source: how to load it and how to put it on a TIME grid
+SOURCES = {"NUTRIENTS": (load_nutrients, resample_nutrients),
+           "TOXINS": (load_toxins, resample_toxins),
+           "ALGAE": (load_algae, resample_algae),
+           "WEATHER": (load_weather, resample_weather)}
+
+
+def resample(raw, TIME, index=None):
+    """All Data_historical variables on the given TIME grid"""
+    if index is None:
+        index = index_samples(raw)
+    out = dict(LOCS=index["SITES"], TIME=TIME)
+    for load, resample_source in SOURCES.values():
+        out.update(resample_source(raw, index, TIME))
+    return {k: out[k] for k in KEYS}
+
+
+def _rows(table):
+    return sum(_rows(t) for t in table.values()) if "time" not in table else len(table["time"])
+
+
+def _counted(blocks, rec):
+    """blocks, adding their readings up in rec["rows"]"""
+    rec["rows"] = 0
+    for cols in blocks:
+        rec["rows"] += len(cols["time"])
+        yield cols
+
+
+def build_weather(folder, cache_dir, grids):
+    """build_source for the weather: every TIME grid in one pass over the
+    station readings, streamed from the sheet a block at a time. With a
+    cache_dir the weather on the grids is cached, keyed on the workbook's
+    content and the grids, so the sheet is only read again once it changes.
+    """
+    def reduce():
+        with stage("regrid", grid=sum(len(TIME) for TIME in grids)) as rec:
+            outs = reduce_weather(_counted(weather_blocks(folder), rec), grids)
+        return {"%d.%s" % (i, k): a for i, out in enumerate(outs) for k, a in out.items()}
+
+    with activate(RunReport()) as report:
+        report.source = "WEATHER"
+        if cache_dir is None:
+            cols = reduce()
+        else:
+            book, sheet, columns = WEATHER
+            with stage("cache", file=book, sheet=sheet) as rec:
+                key = cache_key(os.path.join(folder, book), "reduced", sheet, columns,
+                                WEATHER_STATS, [[float(T[0]), float(T[-1]), len(T)] for T in grids])
+                cols, rec["hit"] = cached_columns(cache_dir, key, reduce)
+        out = [{k: cols["%d.%s" % (i, k)] for k, _, _ in WEATHER_STATS} for i in range(len(grids))]
+    return None, out, report.stages
+
+
+def build_source(source, folder, cache_dir, grids, sites=LOCS):
+    """Load one source and put it on each TIME grid, one column per site
+    Sources share nothing, so this can run in a separate process per source.
+    Returns (samples, [variables per grid], [report stages]), samples None
+    for the weather, which is reduced as it is read (see build_weather).
+    """
+    if source == "WEATHER":
+        return build_weather(folder, cache_dir, grids)
+    load, resample_source = SOURCES[source]
+    with activate(RunReport()) as report:
+        report.source = source
+        with stage("load") as rec:
+            raw = {source: load(folder, cache_dir)}
+            rec["rows"] = _rows(raw[source])
+        with stage("index", rows=rec["rows"]):
+            index = index_samples(raw, sites)
+        out = []
+        for TIME in grids:
+            with stage("regrid", rows=rec["rows"], grid=len(TIME)):
+                out.append(resample_source(raw, index, TIME))
+    return raw[source], out, report.stages
+
+
+###############################################################################
+#### Save
+
+def output_name(days):
+    """Data_historical.npz for daily data (as before), Data_historical_<n>day.npz otherwise"""
+    if days == 1:
+        return "Data_historical.npz"
+    return "Data_historical_%gday.npz" % days
+
+
+## Timing / memory report of the last run (see dlake.report)
+REPORT_FILE = "Data_historical_report.json"
+
+## Sample tables kept for incremental updates (see dlake.latest)
+SAMPLES_FILE = "Data_ingested_samples.npz"
+
+
+def save_samples(outdir, raw):
+    """Store the raw samples of the sources that the Latest sheet can extend"""
+    tables = {"NUTRIENTS": raw["NUTRIENTS"], "ELISA": raw["TOXINS"]["ELISA"]}
+    cols = {}
+    for source, table in tables.items():
+        for k, a in table.items():
+            cols[source + "." + k] = a
+    save_columns(os.path.join(outdir, SAMPLES_FILE), cols)
+
+
+def load_samples(outdir):
+    """Inverse of save_samples, returns {source: columns}"""
+    tables = {}
+    for key, a in load_columns(os.path.join(outdir, SAMPLES_FILE)).items():
+        source, k = key.split(".", 1)
+        tables.setdefault(source, {})[k] = a
+    return tables
+
+
+def make_historical(resolutions=(1, 7), folder="./Historical", outdir="../Preprocessed",
+                    cache_dir=None, processes=None, formats=("npz",), compact=False,
+                    sites=LOCS):
+    """Parse the raw data once and save one Data_historical*.npz per resolution (days)
+
+    processes: load and regrid the sources in that many worker processes
+               (None or 1 runs them one after another, the output is identical)
+    formats: "npz" for the usual compressed-style archive, "npy" for a
+             memory-mapped store folder of the same name (see dlake.store)
+             "chunks" for <name>.chunks, one compressed file per year of
+             TIME (see dlake.chunked) and/or "sparse" for <name>_sparse.npz,
+             with DEN, TBV and FBV stored sparse (see dlake.sparse)
+    compact: store the variables as float32 or scaled integers, after checking
+             that none loses more than its declared precision (see dlake.compact)
+    sites: site codes, one column each in that order (see dlake.sites.load_sites)
+    """
+    report = RunReport()
+    grids = [time_grid(TIME_START, TIME_END, days=days) for days in resolutions]
+    args = (list(SOURCES), [folder] * len(SOURCES), [cache_dir] * len(SOURCES),
+            [grids] * len(SOURCES), [list(sites)] * len(SOURCES))
+    if processes and processes > 1:
+        with ProcessPoolExecutor(min(processes, len(SOURCES))) as pool:
+            results = list(pool.map(build_source, *args))
+    else:
+        results = list(map(build_source, *args))
+
+    # merge in a fixed order whatever finished first
+    raw = {}
+    for source, (samples, _, stages) in zip(SOURCES, results):
+        raw[source] = samples
+        report.stages += stages
+    outputs = []
+    with activate(report):
+        with stage("save", file=SAMPLES_FILE):
+            save_samples(outdir, raw)
+        for i, days in enumerate(resolutions):
+            out = dict(LOCS=list(sites), TIME=grids[i])
+            for r in results:
+                out.update(r[1][i])
+            out = {k: out[k] for k in KEYS}
+            if compact:
+                with stage("compact", rows=len(grids[i])):
+                    out = encode_product(out)
+            name = output_name(days)
+            if "npz" in formats:
+                with stage("save", file=name, rows=len(grids[i])) as rec:
+                    np.savez(os.path.join(outdir, name), **out)
+                rec["bytes"] = os.path.getsize(os.path.join(outdir, name))
+                outputs.append(name)
+            if "npy" in formats:
+                name = name[:-len(".npz")]
+                with stage("save", file=name, rows=len(grids[i])):
+                    save_store(os.path.join(outdir, name), out, days=days)
+                outputs.append(name)
+            if "chunks" in formats:
+                name = output_name(days)[:-len(".npz")] + ".chunks"
+                with stage("save", file=name, rows=len(grids[i])) as rec:
+                    rec["written"] = save_chunked(os.path.join(outdir, name), out, days=days)
+                outputs.append(name)
+            if "sparse" in formats:
+                name = sparse_name(output_name(days))
+                with stage("save", file=name, rows=len(grids[i])) as rec:
+                    save_sparse(os.path.join(outdir, name), out)
+                rec["bytes"] = os.path.getsize(os.path.join(outdir, name))
+                outputs.append(name)
+    report.save(os.path.join(outdir, REPORT_FILE), resolutions=list(resolutions),
+                processes=processes or 1, compact=compact, sites=len(sites), outputs=outputs)
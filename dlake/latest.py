@@ -0,0 +1,137 @@
+## Incremental update of the Data_historical products from the Latest sheet
+#! The Prediction Lab 2019
+#
+# Only samples newer than the last ingested one are taken from the PREDICT
+# sheet. For each product the TIME grid is extended to cover them, and only
+# the tail of TIME from each affected site's previous sample onwards is
+# regridded; everything before it cannot change. Together with
+# make_historical this gives the same NUT and TOX arrays as a rebuild on all
+# the samples (variables the sheet doesn't carry are padded with NaN).
+import os
+import glob
+import numpy as np
+from dlake.xlsx import read_sheet
+from dlake.groupby import GroupIndex
+from dlake.store import open_store, load_product, save_product
+from dlake.compact import encode_product
+from dlake.regrid import regrid_nearest, blank_repeats
+from dlake.timeconv import datetime2year, year2datetime, time_grid, TIME_START
+from dlake.sites import site_index
+from dlake.historical import load_samples, save_samples
+
+## Columns of the PREDICT sheet (headers are on row 2, some repeat so go by letter)
+PREDICT = {
+    "ELISA": {"date": "A", "time": "B", "loc": "C",
+              "mic": "E", "cyl": "F"},
+    "NUTRIENTS": {"date": "G", "time": "H", "loc": "I",
+                  "nut1": "L", "nut2": "M", "nut3": "N", "nut4": "O"},
+}
+
+## Product variables fed by each source: (keys, sample columns, min samples per site)
+VARIABLES = {
+    "NUTRIENTS": (["NUT1", "NUT2", "NUT3", "NUT4"], ["nut1", "nut2", "nut3", "nut4"], 1),
+    "ELISA": (["TOX3", "TOX4"], ["cyl", "mic"], 3),
+}
+
+
+def load_latest(path, cache_dir=None):
+    """Samples of the PREDICT sheet as {source: columns}, like load_raw"""
+    tables = {}
+    for source, columns in PREDICT.items():
+        cols = read_sheet(path, "PREDICT", columns, header_row=2, cache_dir=cache_dir)
+        ok = np.isnat(cols["date"]) == 0
+        when = cols["date"][ok] + np.where(np.isnat(cols["time"][ok]),
+                                           np.timedelta64(0, "us"), cols["time"][ok])
+        table = {"time": datetime2year(when)}
+        for k in columns:
+            if k not in ("date", "time"):
+                table[k] = cols[k][ok]
+        tables[source] = table
+    return tables
+
+
+def _extend_grid(TIME, tmax):
+    """TIME continued with the same step until it passes tmax (decimal years)"""
+    days = (year2datetime(TIME[1]) - year2datetime(TIME[0])) / np.timedelta64(1, "D")
+    days = round(days, 6)
+    end = year2datetime(tmax) + np.timedelta64(int(round(days * 86400e6)), "us")
+    grid = time_grid(TIME_START, end, days=days)
+    if len(grid) <= len(TIME):
+        return TIME
+    assert np.array_equal(grid[:len(TIME)], TIME), "TIME grid does not start at TIME_START"
+    return grid
+
+
+def _update_product(data, samples, new):
+    """Extend one product's arrays with the new samples (data is changed in place)"""
+    tmax = max(new[s]["time"].max() for s in new if len(new[s]["time"]))
+    TIME = _extend_grid(data["TIME"], tmax)
+    pad = len(TIME) - len(data["TIME"])
+    if pad:
+        for k, a in data.items():
+            if k not in ("LOCS", "TIME", "DIV"):
+                data[k] = np.concatenate((a, np.full((pad,) + a.shape[1:], np.nan)))
+        data["TIME"] = TIME
+
+    sites = [str(s) for s in data["LOCS"]]
+    for source, (keys, fields, min_samples) in VARIABLES.items():
+        if not len(new[source]["time"]):
+            continue
+        old, add = samples[source], new[source]
+        site_old = site_index(old["loc"], sites)
+        site_new = site_index(add["loc"], sites)
+        affected = np.unique(site_new[site_new >= 0])
+        if not len(affected):
+            continue
+
+        # tail of TIME that can change: from each affected site's last old sample,
+        # or the whole record for sites that only now have enough samples
+        count = np.bincount(site_old[site_old >= 0], minlength=len(sites))
+        t0 = np.inf
+        for i in affected:
+            if count[i] > min_samples:
+                t0 = min(t0, old["time"][site_old == i].max())
+            else:
+                t0 = -np.inf
+        start = np.searchsorted(TIME, t0, side="left") if np.isfinite(t0) else 0
+
+        t = np.concatenate((old["time"], add["time"]))
+        site = np.concatenate((site_old, site_new))
+        v = np.column_stack([np.concatenate((old[f], add[f])) for f in fields])
+        N = regrid_nearest(GroupIndex(site, len(sites), t), t, v, TIME[start:], min_samples)
+        for j, k in enumerate(keys):
+            X = data[k]
+            X[start:, affected] = N[:, affected, j]
+            X[:, affected] = blank_repeats(X[:, affected])
+
+
+def append_latest(path, outdir="../Preprocessed", cache_dir=None):
+    """Add the Latest samples newer than the last ingested ones to every
+    Data_historical* product (any format, compact ones stay compact) in outdir.
+    Returns the number of new samples.
+    """
+    samples = load_samples(outdir)
+    latest = load_latest(path, cache_dir)
+    new = {}
+    for source, table in latest.items():
+        ID = table["time"] > samples[source]["time"].max()
+        new[source] = {k: a[ID] for k, a in table.items()}
+    nnew = sum(len(t["time"]) for t in new.values())
+    if not nnew:
+        return 0
+
+    for f in sorted(glob.glob(os.path.join(outdir, "Data_historical*"))):
+        if not (f.endswith(".npz") or os.path.isdir(f)):
+            continue
+        with open_store(f) as stored:
+            compact = "COMPACT" in stored.files
+        data = load_product(f)
+        _update_product(data, samples, new)
+        save_product(f, encode_product(data) if compact else data)
+
+    # remember what has been ingested
+    for source in new:
+        samples[source] = {k: np.concatenate((samples[source][k], new[source][k]))
+                           for k in samples[source]}
+    save_samples(outdir, {"NUTRIENTS": samples["NUTRIENTS"], "TOXINS": {"ELISA": samples["ELISA"]}})
+    return nnew
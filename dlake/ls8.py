@@ -0,0 +1,284 @@
+## Landsat 8 scenes (ACOLITE L2W netCDF): pixels of the lake locations
+#! The Prediction Lab 2019
+#
+# Only the pixels nearest to the lake locations are read from a scene. Scenes
+# of the same path/row share their grid, so the nearest pixels are found once
+# per grid: the lon/lat arrays are read in full only for a grid not seen
+# before (KD-tree on the pixel lon/lats, the same nearest pixel as
+# griddata(..., 'nearest')) and the result is kept on disk under a key made
+# of the grid's shape, a sparse sample of its coordinates and the locations.
+# The bands are then read as the window around the locations (one hyperslab
+# per band) or, if that window is large, one pixel per location, and all bands
+# at all locations come out of a single gather, so the I/O and memory of a
+# scene go with the lake (or number of locations), not the scene size.
+#
+# Bands are any list of band names, read from the <product>_<band> variables,
+# eg. rhorc_655 or rhos_655 (ACOLITE), so other band sets and sensors only
+# need their band list.
+#
+# Scenes are independent, so extract_scenes can spread them over worker
+# processes. Each worker writes its scenes' rows straight into COL, which
+# lives in shared memory, so row t is always files[t] whatever finishes first.
+#
+# update_timeseries keeps a manifest of the scenes in the time series (name,
+# size, sha256), so a new overpass only needs its own scene read: new or
+# changed scenes are extracted and merged into COL/TIME in time order, and
+# scenes no longer in the folder are dropped.
+import os
+import json
+import hashlib
+import datetime
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from netCDF4 import Dataset
+from scipy.spatial import cKDTree
+from dlake.cache import cached_columns, file_digest
+from dlake.timeconv import datetime2year
+
+## Bands of the scenes, in the order of COL's second axis (nm)
+BANDS = ["443", "483", "561", "655", "865", "1609", "2201"]
+
+## Reflectance products (variable name prefixes), first found is used by default
+PRODUCTS = ("rhorc", "rhos")
+
+## Largest window (pixels per band) read in one piece
+WINDOW = 1 << 20
+
+## Bump when the lookup itself changes, to invalidate cached entries
+LOOKUP_VERSION = 2
+
+## Coordinates sampled along each axis for the grid key
+KEY_SAMPLES = 16
+
+
+class PixelIndex(object):
+    """Nearest pixel of a scene grid (lon, lat 2-d arrays) to any point"""
+
+    def __init__(self, lon, lat):
+        self.shape = np.shape(lon)
+        self.tree = cKDTree(np.column_stack((np.ravel(lon), np.ravel(lat))))
+
+    def nearest(self, lon, lat):
+        """Flat index into the grid of the pixel nearest to each (lon, lat)"""
+        _, i = self.tree.query(np.column_stack((np.ravel(lon), np.ravel(lat))))
+        return i
+
+
+def grid_key(data, LOCS):
+    """Key of a scene's grid and the locations, from the grid's shape and a
+    KEY_SAMPLES x KEY_SAMPLES sample of its lon/lats (plus the far corner),
+    without reading the whole grid
+    """
+    h = hashlib.sha256()
+    h.update(("ls8-pixels-%d" % LOOKUP_VERSION).encode())
+    for name in ("lon", "lat"):
+        v = data[name]
+        ny, nx = v.shape
+        sy, sx = max(ny // KEY_SAMPLES, 1), max(nx // KEY_SAMPLES, 1)
+        h.update(repr(v.shape).encode())
+        h.update(np.ascontiguousarray(v[::sy, ::sx], dtype=float).tobytes())
+        h.update(np.ascontiguousarray(v[ny - 1, nx - 1], dtype=float).tobytes())
+    h.update(np.ascontiguousarray(LOCS, dtype=float).tobytes())
+    return h.hexdigest()
+
+
+## Lookups done in this process, by grid key
+_lookups = {}
+
+
+def scene_pixels(data, LOCS, cache_dir=None):
+    """(row, column) of the pixel nearest to each location (LOCS rows are
+    lon, lat) in an open scene, found once per grid and cached in cache_dir
+    """
+    key = grid_key(data, LOCS)
+    if key not in _lookups:
+        def build():
+            lon, lat = np.asarray(data["lon"][:]), np.asarray(data["lat"][:])
+            LOCS_ = np.asarray(LOCS, dtype=float)
+            i = PixelIndex(lon, lat).nearest(LOCS_[:, 0], LOCS_[:, 1])
+            row, col = np.unravel_index(i, lon.shape)
+            return {"row": row, "col": col}
+        if cache_dir is None:
+            cols = build()
+        else:
+            cols = cached_columns(cache_dir, key, build)[0]
+        _lookups[key] = (cols["row"], cols["col"])
+    return _lookups[key]
+
+
+def scene_bands(data, product):
+    """Bands of the <product>_<band> variables of an open scene, by wavelength"""
+    prefix = product + "_"
+    bands = [v[len(prefix):] for v in data.variables if v.startswith(prefix)]
+    return sorted((b for b in bands if b.isdigit()), key=int)
+
+
+def band_variables(data, bands, product=None):
+    """Variable names of the bands in an open scene (product None: the first
+    of PRODUCTS that has them all)
+    """
+    for p in [product] if product else PRODUCTS:
+        names = ["%s_%s" % (p, b) for b in bands]
+        if all(n in data.variables for n in names):
+            return names
+    raise KeyError("%s has no %s variables for bands %s"
+                   % (data.filepath(), product or "/".join(PRODUCTS), ", ".join(bands)))
+
+
+def read_bands(data, names, row, col):
+    """(bands, locations) values of 2-d variables at (row, col) pixels, as one
+    gather from the window around the pixels (one hyperslab per band) or, if
+    that is larger than WINDOW, from the distinct pixels read one by one
+    """
+    r0, c0 = row.min(), col.min()
+    r1, c1 = row.max() + 1, col.max() + 1
+    if (r1 - r0) * (c1 - c0) <= WINDOW:
+        cube = np.stack([data[n][r0:r1, c0:c1] for n in names])
+        return cube[:, row - r0, col - c0].astype(float)
+    pixels, inverse = np.unique(np.column_stack((row, col)), axis=0, return_inverse=True)
+    cube = np.array([[data[n][r, c] for r, c in pixels.tolist()] for n in names], dtype=float)
+    return cube[:, inverse.ravel()]
+
+
+def scene_date(path):
+    """Acquisition date in an L2W file name, L8_OLI_<yyyy>_<mm>_<dd>_..."""
+    parts = os.path.basename(path).split("_")
+    return datetime.datetime(int(parts[2]), int(parts[3]), int(parts[4]))
+
+
+def read_scene(path, LOCS, cache_dir=None, bands=BANDS, product=None):
+    """Reflectance (<product>_<band>) of each band at each location,
+    (bands, locations). Values are as stored, fill values included.
+    """
+    with Dataset(path) as data:
+        data.set_auto_mask(False)
+        row, col = scene_pixels(data, LOCS, cache_dir)
+        return read_bands(data, band_variables(data, bands, product), row, col)
+
+
+## Worker state: COL in shared memory and what read_scene needs
+_worker = {}
+
+
+def _attach(name, shape, LOCS, cache_dir, bands, product):
+    shm = shared_memory.SharedMemory(name=name)
+    _worker.update(shm=shm, COL=np.ndarray(shape, dtype=float, buffer=shm.buf),
+                   LOCS=LOCS, cache_dir=cache_dir, bands=bands, product=product)
+
+
+def _extract(t, path):
+    w = _worker
+    w["COL"][t] = read_scene(path, w["LOCS"], w["cache_dir"], w["bands"], w["product"])
+    return t
+
+
+def extract_scenes(files, LOCS, processes=None, cache_dir=None, bands=BANDS, product=None):
+    """COL (scene, band, location) of a list of scenes, row t from files[t]
+
+    processes: read the scenes in that many worker processes (None or 1
+               reads them one after another, the output is identical)
+    """
+    shape = (len(files), len(bands), len(LOCS))
+    if not processes or processes < 2 or len(files) < 2:
+        COL = np.zeros(shape)
+        for t, path in enumerate(files):
+            COL[t] = read_scene(path, LOCS, cache_dir, bands, product)
+        return COL
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+    try:
+        shared = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        shared[...] = 0
+        with ProcessPoolExecutor(min(processes, len(files)), initializer=_attach,
+                                 initargs=(shm.name, shape, np.asarray(LOCS), cache_dir,
+                                           list(bands), product)) as pool:
+            list(pool.map(_extract, range(len(files)), files))
+        COL = shared.copy()
+        del shared  # the buffer can't be released while a view of it exists
+    finally:
+        shm.close()
+        shm.unlink()
+    return COL
+
+
+###############################################################################
+#### Incremental time series
+
+## Version of the scene manifest
+MANIFEST_VERSION = 1
+
+
+def _settings(LOCS, bands, product):
+    """What the rows of COL depend on besides the scenes themselves"""
+    return {"version": MANIFEST_VERSION, "lookup": LOOKUP_VERSION, "bands": list(bands),
+            "product": product,
+            "locations": hashlib.sha256(np.ascontiguousarray(LOCS, dtype=float).tobytes()).hexdigest()}
+
+
+def _scene_record(path, known):
+    """{file, size, mtime, hash} of a scene, reusing the hash of a file whose
+    size and mtime are those recorded
+    """
+    st = os.stat(path)
+    rec = {"file": os.path.basename(path), "size": st.st_size, "mtime": st.st_mtime_ns}
+    old = known.get(rec["file"])
+    if old and old["size"] == rec["size"] and old["mtime"] == rec["mtime"]:
+        rec["hash"] = old["hash"]
+    else:
+        rec["hash"] = file_digest(path)
+    return rec
+
+
+def update_timeseries(files, LOCS, path, manifest, processes=None, cache_dir=None,
+                      bands=BANDS, product=None, full=False):
+    """Bring the time series in path (COL, TIME, BANDS) up to date with the
+    scenes in files, reading only scenes not in the manifest (or changed
+    since). Scenes are in time order, as a full rebuild would put them.
+    full: read every scene again
+
+    Returns (read, dropped): number of scenes read and of scenes removed.
+    """
+    settings = _settings(LOCS, bands, product)
+    old = None
+    if not full and os.path.exists(path) and os.path.exists(manifest):
+        with open(manifest) as f:
+            old = json.load(f)
+        if old.get("settings") != settings:
+            old = None
+    known = {r["file"]: r for r in old["scenes"]} if old else {}
+    records = [_scene_record(f, known) for f in files]
+
+    # rows kept from the existing series, and scenes to read
+    keep, new = {}, []
+    if old:
+        with np.load(path) as data:
+            COL = data["COL"]
+        row = {r["file"]: i for i, r in enumerate(old["scenes"])}
+        for f, rec in zip(files, records):
+            prev = known.get(rec["file"])
+            if prev and prev["hash"] == rec["hash"] and prev["size"] == rec["size"]:
+                keep[rec["file"]] = COL[row[rec["file"]]]
+            else:
+                new.append(f)
+        dropped = len(set(known) - set(r["file"] for r in records))
+    else:
+        new, dropped = list(files), 0
+    read = extract_scenes(new, LOCS, processes, cache_dir, bands, product)
+    rows = dict(keep)
+    rows.update((os.path.basename(f), a) for f, a in zip(new, read))
+
+    # merge in time order (ties by name, like the sorted file list)
+    when = [scene_date(f) for f in files]
+    order = sorted(range(len(files)), key=lambda i: (when[i], records[i]["file"]))
+    COL = np.zeros((len(files), len(bands), len(LOCS)))
+    for t, i in enumerate(order):
+        COL[t] = rows[records[i]["file"]]
+    COL[COL <= 0] = 1e-10  # clear (remove neg numbers)
+    TIME = datetime2year([when[i] for i in order])
+
+    np.savez(path, COL=COL, TIME=TIME, BANDS=np.asarray(bands))
+    tmp = "%s.%d.tmp" % (manifest, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump({"settings": settings, "scenes": [records[i] for i in order]}, f, indent=1)
+    os.replace(tmp, manifest)
+    return len(new), dropped
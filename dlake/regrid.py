@@ -0,0 +1,124 @@
+## Batched nearest-neighbour regridding onto a TIME grid
+#! The Prediction Lab 2019
+#
+# Does for many (variable, site, division) groups at once what
+#   f = interpolate.interp1d(t,n,kind='nearest',bounds_error=False,fill_value=np.nan)
+#   N = f(TIME)
+# followed by blanking repeated values does for a single one, and gives the
+# same numbers (same midpoints and tie breaking as scipy).
+#
+# BinReducer instead reduces every reading that falls in a grid step (mean,
+# min, max, sum), for frequent readings such as weather or stream gauges.
+import numpy as np
+from dlake.timeindex import TimeIndex
+
+
+def blank_repeats(N):
+    """Blank (NaN) values equal to the next non-NaN value along axis 0,
+    so only the last of each run of repeated values is kept
+    """
+    N = np.array(N, dtype=float)
+    T = N.shape[0]
+    valid = np.isnan(N) == 0
+    # index of the next non-NaN value strictly after each row (T if none)
+    idx = np.where(valid, np.arange(T).reshape((T,) + (1,) * (N.ndim - 1)), T)
+    nxt = np.minimum.accumulate(idx[::-1], axis=0)[::-1]
+    nxt = np.concatenate((nxt[1:], np.full((1,) + N.shape[1:], T)), axis=0)
+    nextval = np.take_along_axis(N, np.minimum(nxt, T - 1), axis=0)
+    N[valid & (nxt < T) & (nextval - N == 0)] = np.nan
+    return N
+
+
+def regrid_nearest(index, t, v, TIME, min_samples=0):
+    """Nearest sample of each group at each TIME, repeated values blanked
+
+    index: GroupIndex of the samples, built with their times (t) so samples
+           are ordered by time within each group
+    t: sample times (decimal years)
+    v: sample values, shape (n,) or (n, nvar) for several variables sampled together
+    TIME: target grid, ascending
+    min_samples: groups with this many samples or fewer are left NaN
+
+    Returns an array of shape (len(TIME), ngroups) or (len(TIME), ngroups, nvar).
+    Outside a group's first/last sample the result is NaN.
+    """
+    TIME = np.asarray(TIME, dtype=float)
+    T = len(TIME)
+    t = index.take(np.asarray(t, dtype=float))
+    v = index.take(np.asarray(v, dtype=float))
+    group, first, count = index.group, index.offsets[:-1], index.counts
+    last = first + count - 1
+
+    # midpoints between consecutive samples of the same group
+    h = t / 2.0
+    bds = h[1:] + h[:-1]
+    same = group[1:] == group[:-1]
+    bds, bgrp = bds[same], group[1:][same]
+
+    # for each group and grid point, number of midpoints below it
+    # (= searchsorted(bds, TIME, side='left') done per group)
+    C = np.zeros((len(index), T + 1), dtype=np.intp)
+    np.add.at(C, (bgrp, np.searchsorted(TIME, bds, side='right')), 1)
+    ind = first[:, None] + np.cumsum(C[:, :T], axis=1)
+
+    # gather and mask outside each group's time range
+    out = np.full((T, len(index)) + v.shape[1:], np.nan)
+    has = count > min_samples
+    ind = ind[has]
+    inside = (TIME[None, :] >= t[first[has]][:, None]) & (TIME[None, :] <= t[last[has]][:, None])
+    vals = v[ind]
+    vals[~inside] = np.nan
+    out[:, has] = np.swapaxes(vals, 0, 1)
+    return blank_repeats(out)
+
+
+class BinReducer(object):
+    """Count, sum, min and max per step of a regular TIME grid, fed block by
+    block in one pass. A TIME point's bin is the step centred on it (midnight
+    to midnight for the daily grid at midday).
+    """
+
+    def __init__(self, TIME):
+        index = TimeIndex(TIME)
+        if not index.regular:
+            raise ValueError("binning needs a regular TIME grid")
+        self.n = len(TIME)
+        self.step = np.timedelta64(index.step, "us")
+        self.first = index.start - self.step // 2
+        self.count, self.sum, self.min, self.max = {}, {}, {}, {}
+
+    def add(self, when, values):
+        """Fold a block of readings in: when (datetime64 array), {variable: values}
+        NaN readings and readings outside the grid or without a time (NaT) are
+        skipped.
+        """
+        when = np.asarray(when).astype("datetime64[us]")
+        with np.errstate(invalid="ignore"):
+            k = (when - self.first) // self.step
+        inside = (k >= 0) & (k < self.n) & ~np.isnat(when)
+        for v, x in values.items():
+            if v not in self.count:
+                self.count[v] = np.zeros(self.n, dtype=int)
+                self.sum[v] = np.zeros(self.n)
+                self.min[v] = np.full(self.n, np.inf)
+                self.max[v] = np.full(self.n, -np.inf)
+            ok = inside & (np.isnan(x) == 0)
+            kk, xx = k[ok], x[ok]
+            self.count[v] += np.bincount(kk, minlength=self.n)
+            self.sum[v] += np.bincount(kk, xx, minlength=self.n)
+            np.minimum.at(self.min[v], kk, xx)
+            np.maximum.at(self.max[v], kk, xx)
+
+    def result(self, variable):
+        """{COUNT, MEAN, MIN, MAX, SUM} of a variable per bin (NaN for empty bins)"""
+        if variable not in self.count:
+            out = {s: np.full(self.n, np.nan) for s in ("MEAN", "MIN", "MAX", "SUM")}
+            out["COUNT"] = np.zeros(self.n, dtype=int)
+            return out
+        n = self.count[variable]
+        out = {"MEAN": self.sum[variable] / np.maximum(n, 1), "SUM": self.sum[variable].copy(),
+               "MIN": self.min[variable].copy(), "MAX": self.max[variable].copy()}
+        for a in out.values():
+            a[n == 0] = np.nan
+        out["COUNT"] = n.copy()
+        return out
@@ -0,0 +1,69 @@
+## Per-stage timing and memory of a preprocessing run
+#! The Prediction Lab 2019
+#
+# Code marks its stages with
+#   with stage("extract", file=path) as rec:
+#       ...
+#       rec["rows"] = n
+# and whatever report is active records wall time, CPU time and peak RSS.
+# make_historical saves the report as json next to the products.
+import sys
+import json
+import time
+import resource
+from contextlib import contextmanager
+
+
+def peak_rss_mb():
+    """High-water mark of this process's resident memory (MB)"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+class RunReport(object):
+    """List of stage records, plus the data source being worked on"""
+
+    def __init__(self):
+        self.stages = []
+        self.source = None
+        self.started = time.time()
+
+    @contextmanager
+    def stage(self, name, **info):
+        rec = dict(stage=name, source=self.source, **info)
+        t, c = time.perf_counter(), time.process_time()
+        try:
+            yield rec
+        finally:
+            rec["wall"] = time.perf_counter() - t
+            rec["cpu"] = time.process_time() - c
+            rec["peak_rss_mb"] = peak_rss_mb()
+            self.stages.append(rec)
+
+    def save(self, path, **info):
+        """Write the stages and any extra run information as json"""
+        out = dict(started=time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                   wall=time.time() - self.started, **info)
+        out["stages"] = self.stages
+        with open(path, "w") as f:
+            json.dump(out, f, indent=1, default=str)
+
+
+## Report that stage() records into (one per process)
+_active = RunReport()
+
+
+@contextmanager
+def activate(report):
+    """Record into report for the duration of the block"""
+    global _active
+    previous, _active = _active, report
+    try:
+        yield report
+    finally:
+        _active = previous
+
+
+def stage(name, **info):
+    """Time a stage in the active report (see RunReport.stage)"""
+    return _active.stage(name, **info)
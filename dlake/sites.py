@@ -0,0 +1,51 @@
+## Site lists for the preprocessing, from the site workbook or a text file
+#! The Prediction Lab 2019
+#
+# The products have one column per site, in the order of the site list.
+# The list defaults to the seven Detroit Lake sites (historical.LOCS) but can
+# be any set of site codes, eg. every Detroit_Reservoir site in
+# Historical/SiteLocations.xlsx or the sites of another reservoir.
+import numpy as np
+from dlake.xlsx import read_sheet
+
+## Site workbook in the Historical folder
+SITES_WORKBOOK = "SiteLocations.xlsx"
+
+
+def site_codes(values):
+    """Site codes as str (numeric codes such as 2112 read as 2112.0 otherwise)"""
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        return np.array(["" if np.isnan(v) else "%d" % v if v == int(v) else repr(v)
+                         for v in values.tolist()], dtype=str)
+    return values.astype(str)
+
+
+def load_sites(path, location=None, cache_dir=None):
+    """Site codes, in order, from a site workbook (Site Code column, only the
+    rows of one General Location if given) or from a text file of one code
+    per line (# comments allowed)
+    """
+    if path.endswith(".xlsx"):
+        cols = read_sheet(path, "SiteLocations", {"code": "Site Code", "where": "General Location"},
+                          cache_dir=cache_dir)
+        codes = site_codes(cols["code"])
+        if location is not None:
+            codes = codes[cols["where"] == location]
+        return [str(c) for c in codes if c]
+    sites = []
+    with open(path) as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if line:
+                sites.append(line)
+    return sites
+
+
+def site_index(loc, sites):
+    """Position of each sample's site in sites (-1 for sites not in the list)
+    One dictionary lookup per distinct code, so the cost is in the samples.
+    """
+    codes, inverse = np.unique(site_codes(loc), return_inverse=True)
+    lookup = {s: i for i, s in enumerate(sites)}
+    return np.asarray([lookup.get(c, -1) for c in codes], dtype=int)[inverse]
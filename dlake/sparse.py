@@ -0,0 +1,185 @@
+## Sparse storage of the mostly empty algae cubes (DEN, TBV, FBV)
+#! The Prediction Lab 2019
+#
+# After repeats are blanked the time x site x division cubes are nearly all
+# NaN (a few samples per site per season), so only the non-NaN entries are
+# kept, compressed by time like a CSR matrix: the entries of time step i are
+# values[indptr[i]:indptr[i+1]] at flat (site, division) positions index[...].
+import os
+import numpy as np
+
+## Products' cubes worth storing sparse
+SPARSE_KEYS = ("DEN", "TBV", "FBV")
+
+
+class SparseCube(object):
+    """Non-NaN entries of a (time, ...) array, compressed by time
+
+    S = SparseCube.from_dense(data['FBV'])
+    S[:, 4, 4]            -> dense array of just that slice
+    S[100:200]            -> dense block of those time steps only
+    S.nanmean(axis=0)     -> same as np.nanmean(data['FBV'], axis=0), without
+                             ever making the dense cube
+    """
+
+    def __init__(self, indptr, index, values, shape):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.index = np.asarray(index)
+        self.values = np.asarray(values)
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = self.values.dtype
+
+    @classmethod
+    def from_dense(cls, X):
+        X = np.asarray(X)
+        flat = X.reshape(len(X), -1)
+        t, i = np.nonzero(~np.isnan(flat))
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(t, minlength=len(X)))))
+        index = i.astype(np.int32 if flat.shape[1] < 2**31 else np.int64)
+        return cls(indptr, index, flat[t, i], X.shape)
+
+    @property
+    def nnz(self):
+        return len(self.values)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _rows(self, rows):
+        """(time steps as an index array, whether rows was a single one)"""
+        single = np.ndim(rows) == 0 and not isinstance(rows, slice)
+        return np.atleast_1d(np.arange(self.shape[0])[rows]), single
+
+    def _block(self, rows, cols=None):
+        """Dense (len(rows), len(cols)) array of time steps rows and flat
+        (site, division) positions cols (all of them if None). Only the
+        entries of those rows are looked at and only the selected columns made.
+        """
+        start, stop = self.indptr[rows], self.indptr[rows + 1]
+        counts = stop - start
+        j = np.repeat(start - np.concatenate(([0], np.cumsum(counts)[:-1])), counts) + \
+            np.arange(counts.sum())
+        r, c = np.repeat(np.arange(len(rows)), counts), self.index[j]
+        if cols is None:
+            out = np.full((len(rows), int(np.prod(self.shape[1:], dtype=np.int64))), np.nan,
+                          dtype=self.dtype)
+            out[r, c] = self.values[j]
+            return out
+        wanted, inverse = np.unique(cols, return_inverse=True)
+        pos = np.minimum(np.searchsorted(wanted, c), max(len(wanted) - 1, 0))
+        hit = wanted[pos] == c if len(wanted) else np.zeros(len(c), dtype=bool)
+        out = np.full((len(rows), len(wanted)), np.nan, dtype=self.dtype)
+        out[r[hit], pos[hit]] = self.values[j[hit]]
+        return out[:, inverse.ravel()]
+
+    def dense(self, rows=slice(None)):
+        """Dense array of the time steps rows (a slice, int or index array)"""
+        rows, single = self._rows(rows)
+        out = self._block(rows).reshape((len(rows),) + self.shape[1:])
+        return out[0] if single else out
+
+    def __getitem__(self, key):
+        """Dense array of a selection; the trailing (site, division) part of
+        the key is resolved on the stored positions, so only the selected
+        columns of the selected time steps are made
+        """
+        key = key if isinstance(key, tuple) else (key,)
+        if len(key) == 1:
+            return self.dense(key[0])
+        rows, single = self._rows(key[0])
+        # flat positions of the selected (site, division) cells
+        cols = np.arange(int(np.prod(self.shape[1:], dtype=np.int64))).reshape(self.shape[1:])
+        cols = cols[key[1:]]
+        out = self._block(rows, np.ravel(cols)).reshape((len(rows),) + np.shape(cols))
+        return out[0] if single else out
+
+    def __array__(self, dtype=None, copy=None):
+        return self.dense() if dtype is None else self.dense().astype(dtype)
+
+    def coords(self):
+        """Full coordinates of every stored entry, one array per axis"""
+        t = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        return (t,) + np.unravel_index(self.index, self.shape[1:])
+
+    def _reduce(self, axis):
+        """(flat output index of every entry, output shape) of a reduction along axis"""
+        if axis is None:
+            return np.zeros(self.nnz, dtype=np.int64), ()
+        axis = axis % len(self.shape)
+        coords = self.coords()
+        keep = [c for k, c in enumerate(coords) if k != axis]
+        shape = tuple(n for k, n in enumerate(self.shape) if k != axis)
+        return np.ravel_multi_index(keep, shape), shape
+
+    def count(self, axis=None):
+        """Number of non-NaN values along axis"""
+        at, shape = self._reduce(axis)
+        n = np.bincount(at, minlength=int(np.prod(shape, dtype=np.int64)))
+        return n.reshape(shape) if shape else n[0]
+
+    def nansum(self, axis=None):
+        at, shape = self._reduce(axis)
+        s = np.bincount(at, self.values, minlength=int(np.prod(shape, dtype=np.int64)))
+        return s.reshape(shape) if shape else s[0]
+
+    def nanmean(self, axis=None):
+        """NaN where there is nothing to average (as np.nanmean, without the warning)"""
+        n, s = self.count(axis), self.nansum(axis)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(n > 0, s / np.maximum(n, 1), np.nan)
+
+    def _extreme(self, axis, ufunc, start):
+        at, shape = self._reduce(axis)
+        out = np.full(int(np.prod(shape, dtype=np.int64)), start, dtype=float)
+        ufunc.at(out, at, self.values)
+        out[np.bincount(at, minlength=len(out)) == 0] = np.nan
+        return out.reshape(shape) if shape else out[0]
+
+    def nanmax(self, axis=None):
+        return self._extreme(axis, np.maximum, -np.inf)
+
+    def nanmin(self, axis=None):
+        return self._extreme(axis, np.minimum, np.inf)
+
+    def to_arrays(self, name):
+        """{name_indptr, name_index, name_values, name_shape} for saving in an npz"""
+        return {name + "_indptr": self.indptr, name + "_index": self.index,
+                name + "_values": self.values, name + "_shape": np.array(self.shape)}
+
+    @classmethod
+    def from_arrays(cls, data, name):
+        return cls(data[name + "_indptr"], data[name + "_index"], data[name + "_values"],
+                   data[name + "_shape"])
+
+
+def sparse_name(name):
+    """Data_historical_7day.npz -> Data_historical_7day_sparse.npz"""
+    return name[:-len(".npz")] + "_sparse.npz"
+
+
+def save_sparse(path, arrays, keys=SPARSE_KEYS):
+    """Save a product as npz with the cubes in keys stored sparse (the rest as is)"""
+    out = {"SPARSE": np.array([k for k in keys if k in arrays])}
+    for k, a in arrays.items():
+        if k in keys:
+            S = a if isinstance(a, SparseCube) else SparseCube.from_dense(a)
+            out.update(S.to_arrays(k))
+        else:
+            out[k] = a
+    tmp = path[:-len(".npz")] + ".%d.tmp.npz" % os.getpid()
+    np.savez(tmp, **out)
+    os.replace(tmp, path)
+
+
+def load_sparse(path):
+    """{key: array}, with the sparse cubes as SparseCube (see dense() to expand)"""
+    with np.load(path, allow_pickle=True) as data:
+        keys = [str(k) for k in data["SPARSE"]]
+        out = {}
+        for k in data.files:
+            if k == "SPARSE" or any(k.startswith(s + "_") for s in keys):
+                continue
+            out[k] = data[k]
+        for k in keys:
+            out[k] = SparseCube.from_arrays(data, k)
+    return out
@@ -0,0 +1,145 @@
+## Memory-mapped store for the preprocessed products
+#! The Prediction Lab 2019
+#
+# A product saved as a folder of uncompressed .npy arrays plus manifest.json,
+# eg. Data/Preprocessed/Data_historical_7day/FBV.npy. Arrays are opened
+# memory mapped, so data['FBV'][:,4,4] only reads the pages holding that
+# site and division instead of the whole cube.
+import os
+import json
+import shutil
+import numpy as np
+from dlake.chunked import ChunkedStore, save_chunked
+from dlake.sparse import SparseCube, save_sparse
+from dlake.compact import decode_product
+
+MANIFEST = "manifest.json"
+STORE_VERSION = 1
+
+
+def _plain(a):
+    """Array that can be memory mapped (strings as unicode, not objects)"""
+    a = np.asarray(a)
+    return a.astype(str) if a.dtype == object else a
+
+
+def save_store(path, arrays, **info):
+    """Write {key: array} as a store folder at path (replacing any old one)"""
+    path = path.rstrip(os.sep)
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    manifest = dict(version=STORE_VERSION, layout="npy", arrays={}, **info)
+    for k, a in arrays.items():
+        a = _plain(a)
+        np.save(os.path.join(tmp, k + ".npy"), a)
+        manifest["arrays"][k] = dict(file=k + ".npy", shape=list(a.shape), dtype=a.dtype.str)
+    with open(os.path.join(tmp, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1)
+
+    # swap the new folder in
+    old = None
+    if os.path.exists(path):
+        old = "%s.%d.old" % (path, os.getpid())
+        os.rename(path, old)
+    os.rename(tmp, path)
+    if old:
+        shutil.rmtree(old)
+
+
+class Store(object):
+    """Read-only, dict-like view of a store folder (same use as np.load of an npz)
+
+    data = Store("Data_historical_7day")
+    data.files           -> keys
+    data['FBV'][:,4,4]   -> only touches the pages of that slice
+    Arrays are copy-on-write by default: they can be modified in memory
+    without changing the files.
+    """
+
+    def __init__(self, path, mmap_mode="c"):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.files = list(self.manifest["arrays"])
+        self._open = {}
+
+    def __getitem__(self, key):
+        if key not in self._open:
+            entry = self.manifest["arrays"][key]
+            self._open[key] = np.load(os.path.join(self.path, entry["file"]),
+                                      mmap_mode=self.mmap_mode)
+        return self._open[key]
+
+    def __contains__(self, key):
+        return key in self.manifest["arrays"]
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._open = {}
+
+
+def _open_folder(path):
+    """Store or ChunkedStore, depending on the folder's manifest"""
+    with open(os.path.join(path, MANIFEST)) as f:
+        layout = json.load(f).get("layout", "npy")
+    return ChunkedStore(path) if layout == "chunks" else Store(path)
+
+
+def open_store(path):
+    """Open a product by name, eg. "../Data/Preprocessed/Data_historical_7day":
+    the memory-mapped store folder if it exists, else the yearly chunked
+    folder (<name>.chunks), else the .npz file
+    """
+    path = path.rstrip(os.sep)
+    if path.endswith(".npz"):
+        return np.load(path, allow_pickle=True)
+    for folder in (path, path + ".chunks"):
+        if os.path.isdir(folder):
+            return _open_folder(folder)
+    return np.load(path + ".npz", allow_pickle=True)
+
+
+def load_product(path):
+    """All arrays of a product (store folder or .npz) in memory, as a dict
+    (a product with sparse cubes, see dlake.sparse, comes back dense and a
+    compact one, see dlake.compact, as float64)
+    """
+    with open_store(path) as data:
+        if "SPARSE" in data.files:
+            keys = [str(k) for k in data["SPARSE"]]
+            out = {k: np.array(data[k]) for k in data.files
+                   if k != "SPARSE" and k.split("_")[0] not in keys}
+            out.update((k, SparseCube.from_arrays(data, k).dense()) for k in keys)
+        else:
+            out = {k: np.array(data[k]) for k in data.files}
+    if "COMPACT" in out:
+        out = decode_product(out)
+    return out
+
+
+def save_product(path, arrays):
+    """Save a product in the format of path: store folder, chunked folder
+    (only the changed chunks are rewritten), .npz with sparse cubes
+    (*_sparse.npz) or .npz
+    """
+    path = path.rstrip(os.sep)
+    if path.endswith(".chunks"):
+        save_chunked(path, arrays)
+    elif path.endswith("_sparse.npz"):
+        save_sparse(path, arrays)
+    elif path.endswith(".npz"):
+        tmp = path[:-len(".npz")] + ".%d.tmp.npz" % os.getpid()
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+    else:
+        save_store(path, arrays)
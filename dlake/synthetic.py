@@ -0,0 +1,103 @@
+## Synthetic raw lake workbooks, same sheets and columns as Data/Raw_lake/Historical
+#! The Prediction Lab 2019
+#
+# For benchmarking the preprocessing at sizes we don't have yet (more sites,
+# more divisions, longer records, higher frequency weather).
+import os
+import datetime
+import numpy as np
+import openpyxl as px
+from dlake.historical import LOCS
+
+
+def site_names(sites):
+    """The real lake sites first, then made up ones"""
+    return LOCS[:sites] + ["S%03d" % i for i in range(len(LOCS), sites)]
+
+
+def _write(path, sheets):
+    """sheets: {title: (header, rows)}, written in streaming (write only) mode"""
+    wb = px.Workbook(write_only=True)
+    for title, (header, rows) in sheets.items():
+        ws = wb.create_sheet(title)
+        ws.append(header)
+        for row in rows:
+            ws.append(row)
+    wb.save(path)
+
+
+def _dates(rng, n, start, years):
+    """n random sample datetimes (daytime) over the given number of years"""
+    day = rng.integers(0, int(365.25 * years), n)
+    minute = rng.integers(8 * 60, 16 * 60, n)
+    return [start + datetime.timedelta(days=int(d), minutes=int(m)) for d, m in zip(day, minute)]
+
+
+def make_workbooks(folder, sites=7, divisions=13, years=6, sample_rows=750,
+                   algae_rows=36000, weather_hours=3, seed=0):
+    """Write Nutrients, CyanotoxinConcentrations, Algae Speciation and Weather
+    data workbooks into folder
+
+    sites, divisions: number of site codes and algal divisions
+    years: length of the record (from 2013)
+    sample_rows: rows of the nutrient sheet and of each toxin sheet
+    algae_rows: rows of the algae speciation sheet
+    weather_hours: time between weather station readings
+    """
+    rng = np.random.default_rng(seed)
+    start = datetime.datetime(2013, 1, 1)
+    names = site_names(sites)
+    os.makedirs(folder, exist_ok=True)
+
+    def values(n, scale, missing=0.05, decimals=4):
+        v = np.round(rng.gamma(1.0, scale, n), decimals).tolist()
+        return [None if m else x for x, m in zip(v, rng.random(n) < missing)]
+
+    # Nutrients
+    n = sample_rows
+    loc = rng.choice(names, n).tolist()
+    # nitrogen to 3 decimals, phosphates to 4 (as declared in dlake.compact.PRECISION)
+    cols = [_dates(rng, n, start, years), loc, values(n, 0.01, 0.9)] + \
+           [values(n, s, 0, d) for s, d in ((0.1, 3), (0.01, 4), (0.2, 3), (0.02, 4))]
+    _write(os.path.join(folder, "Nutrients.xlsx"),
+           {"Nutrients": (["DateTime", "Site Location", "NH3 (mg/L)", "NO3+NO2 (mg/L)",
+                           "O-Phos (mg/L)", "TN (mg/L)", "T-Phos (mg/L)"], zip(*cols))})
+
+    # Toxins
+    header = ["Date/Time", "Site Location", "Cylindro (ppb)", "Microcystin (ppb)"]
+    sheets = {}
+    for title in ["LCMSMS", "ELISA"]:
+        cols = [_dates(rng, n, start, years), rng.choice(names, n).tolist(),
+                values(n, 0.1, 0.4), values(n, 0.2, 0.1)]
+        sheets[title] = (header, zip(*cols))
+    _write(os.path.join(folder, "CyanotoxinConcentrations.xlsx"), sheets)
+
+    # Algae, one row per (site, date, genus) as in the speciation sheet
+    n = algae_rows
+    divs = ["Division%02d" % i for i in range(divisions)]
+    when = [datetime.datetime(d.year, d.month, d.day) for d in _dates(rng, n, start, years)]
+    div = rng.choice(divs, n).tolist()
+    tally = rng.integers(1, 300, n).tolist()
+    den = values(n, 100.0, 0)
+    tbv = values(n, 1e5, 0)
+    fbv = values(n, 5.0, 0)
+    rows = ([l, d, None, None, "Genus " + v, v, t, x * 1000, x, b * 1000, b, f, None]
+            for l, d, v, t, x, b, f in zip(rng.choice(names, n).tolist(), when, div,
+                                          tally, den, tbv, fbv))
+    _write(os.path.join(folder, "Algae Speciation.xlsx"),
+           {"PrioritySites": (["Site Location", "Date", "Time", "Sample Depth", "GENUS",
+                               "DIVISION", "TALLY", "DENSITY (cells/L) ", "DENSITY (cells/mL) ",
+                               "TOTAL BV (um3/L)", "TOTAL BV (um3/mL)", "% BIOVOLUME",
+                               "% ABUNDANCE"], rows)})
+
+    # Weather, regular readings plus a footer row
+    n = int(365.25 * 24 * years / weather_hours)
+    when = [start + datetime.timedelta(hours=weather_hours * i) for i in range(n)]
+    cols = [when] + [values(n, s, decimals=2) for s in (10.0, 50.0, 1, 1, 5.0, 2.0, 1, 0.1, 700.0)]
+    # relative humidity is a percentage
+    cols[2] = [None if x is None else min(x, 100.0) for x in cols[2]]
+    rows = list(zip(*cols)) + [("Total",) + (None,) * 9]
+    _write(os.path.join(folder, "Weather data.xlsx"),
+           {"Weather-BureauRecl Detroit Lake": (["Date", "Temp", "Humidity", "Dew", "Wind Dir",
+                                                 "Peak Wind", "Wind Speed", "Solar", "Rain",
+                                                 "Pressure"], rows)})
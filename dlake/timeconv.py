@@ -0,0 +1,46 @@
+## Decimal-year time conversion shared by the preprocessing scripts
+#! The Prediction Lab 2019
+import datetime
+import numpy as np
+
+
+def _as_datetime64(dt):
+    """datetime / datetime64 / array of either -> datetime64[us] array"""
+    return np.asarray(dt, dtype="datetime64[us]")
+
+
+def datetime2year(dt):
+    """Decimal years for a datetime, a datetime64 or a whole array of either
+    eg. 2013-07-02 12:00 -> 2013.5
+    """
+    dt = _as_datetime64(dt)
+    year = dt.astype("datetime64[Y]")
+    year_start = year.astype("datetime64[us]")
+    year_length = (year + 1).astype("datetime64[us]") - year_start
+    out = year.astype(int) + 1970 + (dt - year_start) / year_length
+    return out[()] if out.ndim == 0 else out
+
+
+def year2datetime(yr):
+    """Inverse of datetime2year, returns datetime64[us]
+    (good to a few microseconds, the float64 resolution of a decimal year)
+    """
+    yr = np.asarray(yr, dtype=float)
+    year = (np.floor(yr).astype(int) - 1970).astype("datetime64[Y]")
+    year_start = year.astype("datetime64[us]")
+    year_length = ((year + 1).astype("datetime64[us]") - year_start).astype(float)
+    offset = np.round((yr - np.floor(yr)) * year_length).astype("timedelta64[us]")
+    return year_start + offset
+
+
+def time_grid(start, end, days=1):
+    """Regular grid in decimal years from start to end (inclusive) every `days` days"""
+    start = _as_datetime64(start)
+    end = _as_datetime64(end)
+    step = np.timedelta64(int(round(days * 86400e6)), "us")
+    return datetime2year(np.arange(start, end + step // 2, step))
+
+
+## Daily grid used by the historical products (midday, from 2013)
+TIME_START = datetime.datetime(2013, 1, 1, 12, 0, 0)
+TIME_END = TIME_START + datetime.timedelta(days=2200)
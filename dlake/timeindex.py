@@ -0,0 +1,134 @@
+## Date lookups on a TIME axis (decimal years) without scanning it
+#! The Prediction Lab 2019
+#
+# idx = TimeIndex(data['TIME'])
+# data['FBV'][idx.between('2018-05-01', '2018-10-01')]   -> a slice, no copy
+# idx.at('2018-06-15')                                   -> nearest row
+# idx.season('JJA'), idx.day_of_year(180)                -> one slice per year
+# On a regular grid (the Data_historical products) rows are found by
+# arithmetic, on an irregular one (LS8 scenes) by binary search.
+import datetime
+import numpy as np
+from dlake.timeconv import year2datetime
+
+## Months of the named seasons (DJF starts in December of the previous year)
+SEASONS = {"DJF": (12, 2), "MAM": (3, 5), "JJA": (6, 8), "SON": (9, 11)}
+
+US = np.timedelta64(1, "us")
+
+
+def _to_ms(dt):
+    """Round datetime64[us] to the millisecond (decimal years are only good to a
+    few microseconds, so TIME[i] should find row i)
+    """
+    ms = np.timedelta64(1000, "us")
+    return (dt + ms // 2) - (dt + ms // 2 - np.datetime64(0, "us")) % ms
+
+
+def as_datetime64(t):
+    """datetime64[us] from a decimal year, datetime, datetime64 or 'YYYY-MM-DD'"""
+    if isinstance(t, (int, float, np.integer, np.floating)):
+        return _to_ms(year2datetime(t)[()])
+    return np.datetime64(t, "us")
+
+
+class TimeIndex(object):
+    """Row lookups by date on a sorted TIME axis (decimal years)
+
+    Ranges are half open, [start, end), and come back as slices.
+    """
+
+    def __init__(self, TIME):
+        self.n = len(TIME)
+        dt = _to_ms(year2datetime(TIME))
+        if np.any(np.diff(dt) < np.timedelta64(0, "us")):
+            raise ValueError("TIME is not sorted")
+        # regular grid: all steps the same
+        self.start = self.step = None
+        if self.n > 1:
+            steps = np.diff(dt) // US
+            if np.all(steps == steps[0]) and steps[0] > 0:
+                self.start = dt[0]
+                self.step = int(steps[0])
+        self.times = None if self.regular else dt
+
+    @property
+    def regular(self):
+        return self.step is not None
+
+    def __len__(self):
+        return self.n
+
+    def _first_at_or_after(self, t):
+        """Row of the first time >= t"""
+        t = as_datetime64(t)
+        if self.regular:
+            k = (t - self.start) // US
+            i = -(-k // self.step)
+            return int(min(max(i, 0), self.n))
+        return int(np.searchsorted(self.times, t, side="left"))
+
+    def at(self, t):
+        """Row nearest to t"""
+        t = as_datetime64(t)
+        if self.regular:
+            i = int(np.floor(((t - self.start) // US) / self.step + 0.5))
+            return min(max(i, 0), self.n - 1)
+        i = int(np.searchsorted(self.times, t))
+        if i == self.n or (i > 0 and t - self.times[i - 1] <= self.times[i] - t):
+            i -= 1
+        return max(i, 0)
+
+    def between(self, start=None, end=None):
+        """Slice of the rows with start <= time < end (None = open)"""
+        i0 = 0 if start is None else self._first_at_or_after(start)
+        i1 = self.n if end is None else self._first_at_or_after(end)
+        return slice(i0, max(i0, i1))
+
+    def year(self, year):
+        """Slice of the calendar year"""
+        return self.between(datetime.datetime(year, 1, 1), datetime.datetime(year + 1, 1, 1))
+
+    def _years(self):
+        if self.regular:
+            first = self.start
+            last = self.start + (self.n - 1) * self.step * US
+        else:
+            first, last = self.times[0], self.times[-1]
+        y0 = first.astype("datetime64[Y]").astype(int) + 1970
+        y1 = last.astype("datetime64[Y]").astype(int) + 1970
+        return range(y0, y1 + 2)
+
+    def months(self, first, last):
+        """One slice per year of the months first..last (inclusive, 1-12;
+        first > last wraps over the new year, eg. 12, 2)
+        """
+        out = []
+        for y in self._years():
+            start = datetime.datetime(y - 1 if first > last else y, first, 1)
+            end = datetime.datetime(y + (last == 12), last % 12 + 1, 1)
+            s = self.between(start, end)
+            if s.stop > s.start:
+                out.append(s)
+        return out
+
+    def season(self, name):
+        """One slice per year of a season, 'DJF', 'MAM', 'JJA' or 'SON'"""
+        return self.months(*SEASONS[name])
+
+    def day_of_year(self, first, last=None):
+        """One slice per year of the days of the year first..last (inclusive, 1 = Jan 1)"""
+        last = first if last is None else last
+        out = []
+        for y in self._years():
+            jan1 = np.datetime64("%04d-01-01" % y, "us")
+            s = self.between(jan1 + (first - 1) * 86400 * 10**6 * US,
+                             jan1 + last * 86400 * 10**6 * US)
+            if s.stop > s.start:
+                out.append(s)
+        return out
+
+
+def take(a, slices):
+    """Rows of a in a list of slices (eg. from season), concatenated"""
+    return np.concatenate([a[s] for s in slices]) if slices else a[:0]
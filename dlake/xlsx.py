@@ -0,0 +1,139 @@
+## Columnar reader for the raw lake workbooks
+#! The Prediction Lab 2019
+import os
+import re
+import datetime
+import numpy as np
+import openpyxl as px
+from openpyxl.utils import column_index_from_string
+from dlake.cache import cache_key, cached_columns
+from dlake.report import stage
+
+
+def _column_index(key, header):
+    """Position of a column given either its header name or its letter"""
+    key = key.strip()
+    if key in header:
+        return header.index(key)
+    if re.fullmatch("[A-Z]{1,3}", key):
+        return column_index_from_string(key) - 1
+    raise KeyError("column %r not found in header %r" % (key, header))
+
+
+def _is_number(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def _to_array(values, dtype=None):
+    """Typed array from a list of cell values
+    - all dates   -> datetime64[us] (missing cells are NaT)
+    - all times   -> timedelta64[us] since midnight (missing cells are NaT)
+    - all numbers -> float64 (missing cells are NaN)
+    - otherwise   -> object array of str
+    dtype=float forces a numeric column, any non-number cell becomes NaN
+    """
+    if dtype is float:
+        return np.array([v if _is_number(v) else np.nan for v in values], dtype=float)
+    kinds = set()
+    for v in values:
+        if v is None:
+            continue
+        if isinstance(v, datetime.datetime):
+            kinds.add("date")
+        elif isinstance(v, datetime.time):
+            kinds.add("time")
+        elif _is_number(v):
+            kinds.add("num")
+        else:
+            kinds.add("str")
+    if kinds == {"date"}:
+        return np.array(values, dtype="datetime64[us]")
+    if kinds == {"time"}:
+        return np.array([np.timedelta64("NaT") if v is None else
+                         np.timedelta64(((v.hour * 60 + v.minute) * 60 + v.second) * 1000000
+                                        + v.microsecond, "us") for v in values],
+                        dtype="timedelta64[us]")
+    if kinds <= {"num"}:
+        return np.array([np.nan if v is None else v for v in values], dtype=float)
+    out = np.empty(len(values), dtype="object")
+    out[:] = [str(v) for v in values]
+    return out
+
+
+def read_sheet(path, sheet, columns, header_row=1, skip_footer=0, dtypes={}, cache_dir=None):
+    """Read selected columns of a worksheet in a single streaming pass
+
+    path: workbook file
+    sheet: worksheet name
+    columns: list of header names, or dict {key: header name or column letter}
+    header_row: 1-based row holding the column headers (data starts below it)
+    skip_footer: number of trailing rows to drop
+    dtypes: optional {key: float} to force numeric columns
+    cache_dir: optional folder caching the parsed columns (see dlake.cache),
+               reused until the workbook changes
+
+    Returns a dict {key: numpy array}. Rows that are empty in every requested
+    column are dropped.
+    """
+    if not isinstance(columns, dict):
+        columns = {c: c for c in columns}
+    name = os.path.basename(path)
+    if cache_dir is not None:
+        with stage("cache", file=name, sheet=sheet) as rec:
+            key = cache_key(path, sheet, columns, header_row, skip_footer,
+                            {k: getattr(d, "__name__", d) for k, d in dtypes.items()})
+            cols, rec["hit"] = cached_columns(cache_dir, key, lambda: read_sheet(
+                path, sheet, columns, header_row, skip_footer, dtypes))
+            rec["rows"] = len(next(iter(cols.values()), []))
+        return cols
+
+    with stage("open", file=name, sheet=sheet):
+        wb = px.load_workbook(path, read_only=True, data_only=True)
+    with stage("extract", file=name, sheet=sheet) as rec:
+        try:
+            rows = wb[sheet].iter_rows(min_row=header_row, values_only=True)
+            header = [str(h).strip() if h is not None else "" for h in next(rows)]
+            idx = [_column_index(c, header) for c in columns.values()]
+            cols = [[] for _ in idx]
+            for row in rows:
+                vals = [row[i] if i < len(row) else None for i in idx]
+                if all(v is None for v in vals):
+                    continue
+                for c, v in zip(cols, vals):
+                    c.append(v)
+        finally:
+            wb.close()
+
+        if skip_footer:
+            cols = [c[:-skip_footer] for c in cols]
+        rec["rows"] = len(cols[0]) if cols else 0
+        return {k: _to_array(c, dtypes.get(k)) for k, c in zip(columns, cols)}
+
+
+def iter_sheet(path, sheet, columns, header_row=1, skip_footer=0, dtypes={}, block=10000):
+    """read_sheet a block of rows at a time, for sheets too long to hold:
+    yields {key: numpy array} of up to `block` rows (types as in read_sheet,
+    per block, so give dtypes for numeric columns)
+    """
+    if not isinstance(columns, dict):
+        columns = {c: c for c in columns}
+    wb = px.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb[sheet].iter_rows(min_row=header_row, values_only=True)
+        header = [str(h).strip() if h is not None else "" for h in next(rows)]
+        idx = [_column_index(c, header) for c in columns.values()]
+        buf = []
+        for row in rows:
+            vals = [row[i] if i < len(row) else None for i in idx]
+            if all(v is None for v in vals):
+                continue
+            buf.append(vals)
+            # hold back the footer rows until the sheet ends
+            if len(buf) == block + skip_footer:
+                out, buf = buf[:block], buf[block:]
+                yield {k: _to_array(list(c), dtypes.get(k)) for k, c in zip(columns, zip(*out))}
+        out = buf[:len(buf) - skip_footer]
+        if out:
+            yield {k: _to_array(list(c), dtypes.get(k)) for k, c in zip(columns, zip(*out))}
+    finally:
+        wb.close()
@@ -0,0 +1,40 @@
+## Build whatever is out of date, from the raw data to the figures
+#! The Prediction Lab 2019
+#
+# Runs the scripts of dlake.build.STAGES whose inputs, script or dlake code
+# changed since their last run, and everything that then reads a changed
+# output, independent scripts in parallel, eg.
+#   python make_all.py                   -> everything that is stale
+#   python make_all.py -n                -> only say what would run and why
+#   python make_all.py petals prediction -> these and what they depend on
+#   python make_all.py --force latest    -> rerun latest (and what changes after it)
+import argparse
+from dlake.build import Build, STAGES, BUILD_DIR
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the stale products and figures")
+    parser.add_argument("targets", nargs="*", help="stages to bring up to date (default: "
+                        "all of %s)" % ", ".join(s.name for s in STAGES))
+    parser.add_argument("-j", "--jobs", type=int, help="stages run at the same time "
+                        "(default: one per CPU)")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+                        help="list the stages that would run and why")
+    parser.add_argument("--force", nargs="+", default=[], choices=[s.name for s in STAGES],
+                        help="run these stages even if up to date")
+    args = parser.parse_args()
+    unknown = set(args.targets) - set(s.name for s in STAGES)
+    if unknown:
+        parser.error("unknown stages: %s" % ", ".join(sorted(unknown)))
+
+    build = Build(STAGES, jobs=args.jobs)
+    if args.dry_run:
+        now, later = build.plan(args.targets, args.force)
+        for name, why in list(now.items()) + list(later.items()):
+            print("%-16s %s" % (name, why))
+        if not now:
+            print("up to date")
+    else:
+        result = build.run(args.targets, args.force)
+        failed = [n for n, r in result.items() if r in ("failed", "skipped")]
+        if failed:
+            raise SystemExit("not built: %s (logs in %s)" % (", ".join(failed), BUILD_DIR))